@@ -2,28 +2,48 @@
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
 ## Contents:
+## compileHomologyPattern
 ## verifyImperfectHomology
+## scanHomology
+## verifyImperfectHomologyBatch
+## EnsemblAnnotator
+## getEnsemblAnnotator
+## annotateGenesExons
 ## add_gene
 ## add_exon
+## MMBSearchRecordError
+## iterMMBSearchRecords
+## readMMBSearchReport
+## annotateEvents
+## readChromosomeEvents
+## annotateChromosome
+## mergePartialResults
 ## createAnnotatedOutput
 
+import numpy as np
 import pandas as pd
-from pyensembl import EnsemblRelease
-from pyensembl.exon import Exon
 import logging
+from functools import lru_cache
 import regex as re
 from ..base import createChrList
 from ..base import rev_compl
 from ..complexity import movingWindow
+from .gtfAnnotation import SortedIntervals, getGTFAnnotator
 
 
-def verifyImperfectHomology(ref, query, min_homology=0.8):
-
+@lru_cache(maxsize=4096)
+def compileHomologyPattern(query, min_homology=0.8, flags=0):
+  #fuzzy regex of the reverse complement of query allowing len*(1-min_homology) errors (at most 10).
+  #Compiled once per distinct query (and flags) in a bounded LRU cache, repeated sBirs are not recompiled
   mmbir = rev_compl(query)
   mmbir_errors = round(len(mmbir)*(1-min_homology))
   if mmbir_errors > 10:
     mmbir_errors = 10
-  output_list = re.findall( '(' + mmbir + '){e<=' + str(mmbir_errors) + '}', ref)
+  return re.compile('(' + mmbir + '){e<=' + str(mmbir_errors) + '}', flags)
+
+def verifyImperfectHomology(ref, query, min_homology=0.8):
+
+  output_list = compileHomologyPattern(query, min_homology).findall(ref)
   print(f'Found {len(output_list)} possible templates for {query}: {output_list}')
 
   if len(output_list) > 0:
@@ -31,154 +51,327 @@ def verifyImperfectHomology(ref, query, min_homology=0.8):
   else:
     return(False)
 
-def add_gene(row):
+def scanHomology(target, query, min_homology=0.8):
+  #number of (non-overlapping, like verifyImperfectHomology) possible templates of query in target,
+  #and the fewest errors (substitutions+insertions+deletions) of any template, -1 if there are none.
+  #The best match is searched for separately (BESTMATCH), only in targets that have a template
+  matches = len(compileHomologyPattern(query, min_homology).findall(target))
+  if matches == 0:
+    return 0, -1
+  best_match = compileHomologyPattern(query, min_homology, re.BESTMATCH).search(target)
+  return matches, sum(best_match.fuzzy_counts)
 
-  data = EnsemblRelease(104)
-  #print("loaded genome! #addgene")
-  output = data.gene_names_at_locus(contig=row['chr'].strip("chr"), position=int(row["iBirStart"]))
-  print(output)
-  #output = str(output)
-  out_list = []
-  for gname in output:
-    if gname != "":
-      out_list.append(gname)
-      #print("appended_gene!")
+def verifyImperfectHomologyBatch(df, query_column="sBir", targets=("ref", "bir"), min_homology=0.8):
+  #batch verifyImperfectHomology: every distinct pattern is compiled once (compileHomologyPattern cache)
+  #and each event is scanned against all target columns in one pass. Returns homology_matches_<target>, homology_best_errors_<target>
+  #and homology_check_<target> columns (aligned with df) instead of printing the templates.
+  columns = {}
+  for target in targets:
+    columns[f"homology_matches_{target}"] = np.zeros(len(df), dtype=np.int64)
+    columns[f"homology_best_errors_{target}"] = np.full(len(df), -1, dtype=np.int64)
 
-  return(out_list) #output
+  target_values = [df[target].tolist() for target in targets]
+  for i, query in enumerate(df[query_column].tolist()):
+    for target, values in zip(targets, target_values):
+      matches, best_errors = scanHomology(values[i], query, min_homology)
+      columns[f"homology_matches_{target}"][i] = matches
+      columns[f"homology_best_errors_{target}"][i] = best_errors
 
-def add_exon(row):
+  result = pd.DataFrame(columns, index=df.index)
+  for target in targets:
+    result[f"homology_check_{target}"] = result[f"homology_matches_{target}"] > 0
+  return result
 
-  data = EnsemblRelease(104)
-  #print("loaded genome! #addexon")
-  output = data.exons_at_locus(contig=row['chr'].strip("chr"), position=int(row["iBirStart"]))
-  #output = str(output)
-  out_list = []
-  for exon in output:
-    if isinstance(exon, Exon):
-      out_list.append(exon.exon_id)
+class EnsemblAnnotator:
+  #gene and exon annotation from one EnsemblRelease. The gene/exon intervals of a contig are read
+  #from the pyensembl database once, on first use, into SortedIntervals; positions are then
+  #answered in batches per contig instead of one database query per event and feature.
+  #For offline annotation from a local GTF see GTFAnnotator, which answers the same calls.
 
-  return(out_list) #output
+  def __init__(self, release=104):
+    from pyensembl import EnsemblRelease
+    self.release = release
+    self.data = EnsemblRelease(release)
+    self._indexes = {}
 
-def createAnnotatedOutput(f_name, path, output_f_name):
-  import os
+  def _index(self, feature, column, contig):
+    if (feature, contig) not in self._indexes:
+      rows = self.data.db.run_sql_query(f"SELECT DISTINCT start, end, {column} FROM {feature} WHERE seqname = ?", query_params=[contig])
+      starts, ends, names = zip(*rows) if rows else ((), (), ())
+      self._indexes[(feature, contig)] = SortedIntervals(starts, ends, names)
+    return self._indexes[(feature, contig)]
 
-  chrList=createChrList(25)
-  df = pd.DataFrame()
+  def annotate(self, contigs, positions):
+    #gene names and exon ids at every (contig, position), 'chr' prefixes are dropped like in Ensembl.
+    #Returns two lists of lists, genes and exons, aligned with the input
+    contigs = pd.Series(contigs).astype(str).str.replace(r"^chr", "", regex=True).to_numpy()
+    positions = np.asarray(positions, dtype=np.int64)
+    genes = [[] for _ in range(len(positions))]
+    exons = [[] for _ in range(len(positions))]
+    for contig in pd.unique(contigs):
+      rows = np.flatnonzero(contigs == contig)
+      contig_genes = self._index("gene", "gene_name", contig).query(positions[rows])
+      contig_exons = self._index("exon", "exon_id", contig).query(positions[rows])
+      for row, row_genes, row_exons in zip(rows, contig_genes, contig_exons):
+        genes[row], exons[row] = row_genes, row_exons
+    return genes, exons
 
-  for chr in chrList:
+#one annotator per release and process, see getEnsemblAnnotator
+_ENSEMBL_ANNOTATORS = {}
+
+def getEnsemblAnnotator(release=104):
+  #returns the annotator of an Ensembl release, loading it only once per process
+  if release not in _ENSEMBL_ANNOTATORS:
+    _ENSEMBL_ANNOTATORS[release] = EnsemblAnnotator(release)
+  return _ENSEMBL_ANNOTATORS[release]
+
+def annotateGenesExons(df, annotator=None):
+  #adds the 'genes' and 'exones' columns (lists of gene names and exon ids at iBirStart)
+  #to an MMBSearch events table in one batched pass. annotator is an EnsemblAnnotator
+  #(default: release 104) or a GTFAnnotator (see getGTFAnnotator)
+  if annotator is None:
+    annotator = getEnsemblAnnotator(104)
+  if len(df) == 0:
+    df["genes"], df["exones"] = [], []
+    return df
+  genes, exons = annotator.annotate(df["chr"], df["iBirStart"].astype(int))
+  df["genes"] = pd.Series(genes, index=df.index, dtype=object)
+  df["exones"] = pd.Series(exons, index=df.index, dtype=object)
+  return df
+
+def add_gene(row, annotator=None):
+  #single-event gene annotation, prefer annotateGenesExons for whole tables.
+  #annotator is an EnsemblAnnotator (default: release 104) or a GTFAnnotator
+  if annotator is None:
+    annotator = getEnsemblAnnotator(104)
+  genes, _ = annotator.annotate([row['chr']], [int(row["iBirStart"])])
+  return(genes[0])
+
+def add_exon(row, annotator=None):
+  #single-event exon annotation, prefer annotateGenesExons for whole tables.
+  #annotator is an EnsemblAnnotator (default: release 104) or a GTFAnnotator
+  if annotator is None:
+    annotator = getEnsemblAnnotator(104)
+  _, exons = annotator.annotate([row['chr']], [int(row["iBirStart"])])
+  return(exons[0])
+
+#columns of the MMBSearch events table, in order; var16-var18 are the unlabeled lines after the second bir
+EVENT_COLUMNS = ["chr", "iBirStart", "Consensus/cluster_number", "iDepth", "sBir", "sBirReversed", "ref", "bir", "TEM",
+                 "Microhomology_Insertion", "Microhomology_template", "readStart", "var16", "var17", "var18"]
+
+#labeled lines of an MMBSearch report record after the ### line: (label, column, type), None for an unlabeled line
+RECORD_HEAD = [("iBirStart:", "iBirStart", int), ("Consensus/cluster number:", "Consensus/cluster_number", str),
+               ("iDepth:", "iDepth", int), ("sBir:", "sBir", str), ("sBirReversed:", "sBirReversed", str),
+               None, ("ref:", "ref", str), ("bir:", "bir", str), ("TEM:", "TEM", str)]
+RECORD_MICROHOMOLOGY = [("Microhomology Insertion:", "Microhomology_Insertion", str),
+                        ("Microhomology template:", "Microhomology_template", str)]
+RECORD_TAIL = [("readStart:", "readStart", int), ("ref:", "ref_read", str), ("bir:", "bir_read", str)]
+RECORD_FREE_LINES = ["var16", "var17", "var18"]
+
+class MMBSearchRecordError(ValueError):
+  #a malformed record in an MMBSearch report, with the line number where it was detected
+  def __init__(self, path, line_number, message):
+    super().__init__(f"{path}:{line_number}: {message}")
+    self.path = path
+    self.line_number = line_number
+
+def iterMMBSearchRecords(lines, chromosome, path=""):
+  #streams typed event dicts (EVENT_COLUMNS) out of the lines of an MMBSearch report. A record starts at a
+  #line containing ###, followed by the RECORD_HEAD lines, the optional microhomology lines, the RECORD_TAIL
+  #lines and three unlabeled lines. Labels are removed as prefixes (str.strip would also eat sequence letters,
+  #e.g. a T at the end of a TEM). Malformed records are yielded as MMBSearchRecordError instead of a dict.
+  numbered = enumerate(lines, start=1)
+  pushed_back = []
+
+  def nextLine():
+    if pushed_back:
+      return pushed_back.pop()
+    return next(numbered, (None, None))
+
+  def nextRecordLine(expected):
+    #next line of the current record. A ### line means the record was cut short: it is pushed back,
+    #so the next record is still parsed, and the error names what was missing
+    line_number, line = nextLine()
+    if line is None:
+      raise MMBSearchRecordError(path, line_number, f"record ends before {expected}")
+    if "###" in line:
+      pushed_back.append((line_number, line))
+      raise MMBSearchRecordError(path, line_number, f"record ends before {expected}, the next record starts here")
+    return line_number, line
+
+  def takeLabeled(label, column, cast, event):
+    line_number, line = nextRecordLine(f"'{label}'")
+    line = line.strip()
+    if not line.startswith(label):
+      raise MMBSearchRecordError(path, line_number, f"expected '{label}', found '{line[:40]}'")
+    value = line[len(label):].strip()
     try:
-      if os.stat(f"{path}{chr}/{f_name}").st_size == 0:
-        print(f"WARNING! File {path}{chr}/{f_name} is empty. Skipping...")
-        continue
-      with open(f"{path}{chr}/{f_name}") as f:
-        lines = f.readlines()
-    except:
-      print(f"WARNING! Couldn't read {path}{chr}/{f_name}. Make sure it's there.")
-      lines = None
+      event[column] = cast(value)
+    except ValueError:
+      raise MMBSearchRecordError(path, line_number, f"'{label}' is not {cast.__name__}: '{value}'")
+
+  while True:
+    line_number, line = nextLine()
+    if line is None:
+      return
+    if "###" not in line:
+      continue
+
+    event = {"chr": chromosome, "Microhomology_Insertion": "Empty", "Microhomology_template": "Empty"}
+    try:
+      for field in RECORD_HEAD:
+        if field is None:
+          nextRecordLine("the unlabeled line after 'sBirReversed:'")
+        else:
+          takeLabeled(*field, event)
+
+      optional_number, optional_line = nextLine()
+      pushed_back.append((optional_number, optional_line))
+      if optional_line is not None and optional_line.strip().startswith(RECORD_MICROHOMOLOGY[0][0]):
+        for field in RECORD_MICROHOMOLOGY:
+          takeLabeled(*field, event)
+      for field in RECORD_TAIL:
+        takeLabeled(*field, event)
+
+      for column in RECORD_FREE_LINES:
+        free_number, free_line = nextLine()
+        if free_line is None or "###" in free_line:
+          pushed_back.append((free_number, free_line))
+          break
+        event[column] = free_line.strip()
+    except MMBSearchRecordError as error:
+      yield error
       continue
 
-    if (type(lines) == None):
-      print("WARNING! the type of lines is None. Skipping...")
-
-    else:
-      print(f"hello {chr}")
-      for i in range(len(lines)):
-        if "###" in lines[i]:
-          i-=1
-          if "Microhomology Insertion:" in lines[i+11]:
-            var0 = lines[i].strip()
-            var1 = lines[i+1].strip()
-            var2 = lines[i+2].strip("iBirStart:").strip()
-            var3 = lines[i+3].strip("Consensus/cluster number:").strip()
-            var4 = lines[i+4].strip("iDepth:").strip()
-            var5 = lines[i+5].strip("sBir:").strip()
-            var6 = lines[i+6].strip("sBirReversed:").strip()
-            var7 = lines[i+7].strip()
-            var8 = lines[i+8].strip("ref:").strip()
-            var9 = lines[i+9].strip("bir:").strip()
-            var10 = lines[i+10].strip("TEM:").strip()
-            var11 = lines[i+11].strip("Microhomology Insertion:").strip()
-            var12 = lines[i+12].strip("Microhomology template:").strip()
-            var13 = lines[i+13].strip("readStart: ").strip()
-            var14 = lines[i+14].strip("ref:").strip()
-            var15 = lines[i+15].strip("bir:").strip()
-            var16 = lines[i+16].strip()
-            var17 = lines[i+17].strip()
-            var18 = lines[i+18].strip()
-            var19 = lines[i+19].strip()
-          else:
-            var0 = lines[i].strip()
-            var1 = lines[i+1].strip()
-            var2 = lines[i+2].strip("iBirStart:").strip()
-            var3 = lines[i+3].strip("Consensus/cluster number:").strip()
-            var4 = lines[i+4].strip("iDepth:").strip()
-            var5 = lines[i+5].strip("sBir:").strip()
-            var6 = lines[i+6].strip("sBirReversed:").strip()
-            var7 = lines[i+7].strip()
-            var8 = lines[i+8].strip("ref:").strip()
-            var9 = lines[i+9].strip("bir:").strip()
-            var10 = lines[i+10].strip("TEM:").strip()
-            var11 = "Empty"
-            var12 = "Empty"
-            var13 = lines[i+11].strip("readStart: ").strip()
-            var14 = lines[i+12].strip("ref:").strip()
-            var15 = lines[i+13].strip("bir:").strip()
-            var16 = lines[i+14].strip()
-            var17 = lines[i+15].strip()
-            var18 = lines[i+16].strip()
-
-          event_dict = {
-                        "chr":chr,
-                        "iBirStart":var2,
-                        "Consensus/cluster_number":var3,
-                        "iDepth":var4,
-                        "sBir":var5,
-                        "sBirReversed":var6,
-                        "ref":var8,
-                        "bir":var9,
-                        "TEM":var10,
-                        "Microhomology_Insertion":var11,
-                        "Microhomology_template":var12,
-                        "readStart":var13,
-                        "var16":var16,
-                        "var17":var17,
-                        "var18":var18
-                        }
-          
-          #make sure that the ref and bir are not empty, otherwise the movingWindow will fail
-          if (len(var8) == 0) or (len(var9) == 0):
-            print(f"ref or bir are empty for {path}{chr}/{f_name}")
-            print("Cheeck if they run correctly in the original output file...")
-            print("Skipping this event...")
-
-            #print the same messages to the error log
-            logging.basicConfig(filename='error.log', level=logging.DEBUG)
-            logging.debug(f"ref or bir are empty for {path}{chr}/{f_name}")
-            logging.debug("Cheeck if they run correctly in the original output file...")
-            logging.debug("Skipping this event...")
-            continue
-
-          event_df = pd.DataFrame.from_records([event_dict])
-          df = pd.concat([df, event_df], ignore_index=True)
+    yield event
+
+def readMMBSearchReport(file_path, chromosome):
+  #parses one per-chromosome MMBSearch report into a list of event dicts, streaming the file.
+  #Malformed records and records with an empty ref or bir are skipped and reported with their line number
+  events = []
+  with open(file_path) as f:
+    for record in iterMMBSearchRecords(f, chromosome, path=file_path):
+      if isinstance(record, MMBSearchRecordError):
+        message = f"Skipping malformed record: {record}"
+      elif (len(record["ref"]) == 0) or (len(record["bir"]) == 0):
+        #the movingWindow complexity would fail on them
+        message = f"ref or bir are empty for the event at iBirStart {record['iBirStart']} in {file_path}, check the original output file. Skipping..."
+      else:
+        events.append(record)
+        continue
+      print(message)
+      #print the same message to the error log
+      logging.basicConfig(filename='error.log', level=logging.DEBUG)
+      logging.debug(message)
+  return events
+
+def annotateEvents(df, annotator=None, label=""):
+  #adds the complexity, homology and gene/exon columns to an MMBSearch events table.
+  #annotator is passed to annotateGenesExons, label names the events in error messages
 
   print("Starting complexity")
 
   try:
     df[['ref_complexity_fail', 'ref_complexity_score', 'ref_complexity_tree']] = df.apply(lambda row: movingWindow(row.ref, complexity_threshold=0.2), axis=1, result_type ='expand')
   except:
-    print(f"Error with ref_complexity for {path}{chr}/{f_name}")
+    print(f"Error with ref_complexity for {label}")
 
   try:
     df[['bir_complexity_fail', 'bir_complexity_score', 'bir_complexity_tree']] = df.apply(lambda row: movingWindow(row.bir, complexity_threshold=0.2), axis=1, result_type ='expand')
   except:
-    print(f"Error with bir_complexity for {path}{chr}/{f_name}")
+    print(f"Error with bir_complexity for {label}")
 
   print("Starting homology check")
-  df['homology_check_ref'] = df.apply(lambda row: verifyImperfectHomology(row.ref, row.sBir), axis=1)
-  df['homology_check_bir'] = df.apply(lambda row: verifyImperfectHomology(row.bir, row.sBir), axis=1)
+  homology = verifyImperfectHomologyBatch(df)
+  df[['homology_check_ref', 'homology_check_bir']] = homology[['homology_check_ref', 'homology_check_bir']]
+  df = df.join(homology.drop(columns=['homology_check_ref', 'homology_check_bir']))
   print("Starting gene/exon annotation")
-  df["genes"] = df.apply(lambda row: add_gene(row), axis=1)
-  df["exones"] = df.apply(lambda row: add_exon(row), axis=1)
+  return annotateGenesExons(df, annotator=annotator)
+
+def readChromosomeEvents(path, chr, f_name):
+  #events of one chromosome directory, an empty list if its report is empty or missing
+  import os
+
+  file_path = f"{path}{chr}/{f_name}"
+  try:
+    if os.stat(file_path).st_size == 0:
+      print(f"WARNING! File {file_path} is empty. Skipping...")
+      return []
+    print(f"hello {chr}")
+    return readMMBSearchReport(file_path, chr)
+  except OSError:
+    print(f"WARNING! Couldn't read {file_path}. Make sure it's there.")
+    return []
+
+def _annotatorFor(gtf_path):
+  #the cached annotator of this process (see getGTFAnnotator/getEnsemblAnnotator)
+  return getGTFAnnotator(gtf_path) if gtf_path is not None else getEnsemblAnnotator(104)
+
+def annotateChromosome(args):
+  #pipeline worker: parses and annotates one chromosome and writes its partial result TSV.
+  #The annotator is loaded once per worker process and reused for every chromosome it gets.
+  #Returns the chromosome, its number of events and the partial path (None without events)
+  f_name, path, chr, partial_path, gtf_path = args
+  df = pd.DataFrame.from_records(readChromosomeEvents(path, chr, f_name), columns=EVENT_COLUMNS)
+  if len(df) == 0:
+    return chr, 0, None
+  df = annotateEvents(df, annotator=_annotatorFor(gtf_path), label=f"{path}{chr}/{f_name}")
+  df.to_csv(partial_path + ".tmp", sep="\t", index=False)
+  import os
+  os.replace(partial_path + ".tmp", partial_path)
+  return chr, len(df), partial_path
+
+def mergePartialResults(partial_paths, output_f_name):
+  #concatenates per-chromosome partial TSVs, in the given order, into the final output.
+  #Values are read back as text, so they are written out exactly as the workers wrote them
+  frames = [pd.read_csv(partial_path, sep="\t", dtype=str, keep_default_na=False) for partial_path in partial_paths]
+  df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=EVENT_COLUMNS)
+  df.to_csv(output_f_name, sep="\t", index=False)
+  return df
+
+def createAnnotatedOutput(f_name, path, output_f_name, gtf_path=None, num_processes=1, partial_dir=None, keep_partials=False):
+  #gtf_path annotates genes/exons offline from a local GTF instead of pyensembl.
+  #With num_processes > 1 (None: all available CPUs) every chromosome is parsed and annotated in
+  #a process pool, written to partial_dir (default: output_f_name + '_partials') and merged at the end.
+  import os
+
+  chrList=createChrList(25)
+
+  if num_processes is None:
+    from ..paralleltools import availableCPUs
+    num_processes = availableCPUs()
+
+  if num_processes > 1:
+    from multiprocessing import Pool
+    if partial_dir is None:
+      partial_dir = output_f_name + "_partials"
+    os.makedirs(partial_dir, exist_ok=True)
+    tasks = [(f_name, path, chr, os.path.join(partial_dir, f"{chr}.tsv"), gtf_path) for chr in chrList]
+
+    #the GTF index is built (if needed) and saved here once, so the workers only load it
+    if gtf_path is not None:
+      getGTFAnnotator(gtf_path)
+    #one annotator per worker, loaded when the worker starts
+    with Pool(min(num_processes, len(tasks)), initializer=_annotatorFor, initargs=(gtf_path,)) as pool:
+      results = {chr: (n_events, partial_path) for chr, n_events, partial_path in pool.imap_unordered(annotateChromosome, tasks)}
+
+    partial_paths = [results[chr][1] for chr in chrList if results[chr][1] is not None]
+    df = mergePartialResults(partial_paths, output_f_name)
+    if not keep_partials:
+      for partial_path in partial_paths:
+        os.remove(partial_path)
+      if not os.listdir(partial_dir):
+        os.rmdir(partial_dir)
+    print(f"finished annotation of {len(df)} events... DF saved to {output_f_name}")
+    return
+
+  events = []
+  for chr in chrList:
+    events.extend(readChromosomeEvents(path, chr, f_name))
+
+  #the table is built once, from all events of all chromosomes
+  df = pd.DataFrame.from_records(events, columns=EVENT_COLUMNS)
+  df = annotateEvents(df, annotator=_annotatorFor(gtf_path), label=f"{path}*/{f_name}")
 
   df.to_csv(output_f_name, sep="\t",index=False)
   print(f"finished annotation... DF saved to {output_f_name}")
\ No newline at end of file
@@ -1,5 +1,11 @@
 # This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
-from .AnnoMMBS import createAnnotatedOutput
-from .makeMMBSearchRef import createMMBSearchReference
\ No newline at end of file
+from ..lazyImports import attachLazyImports
+
+#submodules are only imported when one of their names is first used
+__getattr__, __dir__, __all__ = attachLazyImports(__name__, ['AnnoMMBS', 'gtfAnnotation', 'makeMMBSearchRef'], {
+  '.AnnoMMBS': ['createAnnotatedOutput', 'annotateGenesExons', 'EnsemblAnnotator', 'getEnsemblAnnotator'],
+  '.gtfAnnotation': ['GTFAnnotator', 'getGTFAnnotator'],
+  '.makeMMBSearchRef': ['createMMBSearchReference'],
+})
\ No newline at end of file
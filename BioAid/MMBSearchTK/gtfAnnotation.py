@@ -0,0 +1,170 @@
+# This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
+# Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
+
+## Contents:
+## SortedIntervals
+## readGTF
+## GTFAnnotator
+## getGTFAnnotator
+
+import os
+import numpy as np
+import pandas as pd
+
+#Offline gene/exon annotation from a local GTF file (e.g. Homo_sapiens.GRCh38.104.gtf.gz), no pyensembl
+#download or sqlite database needed. GTFAnnotator answers the same annotate(contigs, positions) calls as
+#the pyensembl-backed EnsemblAnnotator, so either can be passed to annotateGenesExons/createAnnotatedOutput.
+
+GTF_COLUMNS = ["seqname", "source", "feature", "start", "end", "score", "strand", "frame", "attribute"]
+
+#GTF attribute used as the name of each feature type, other features default to gene_id
+FEATURE_NAMES = {"gene": "gene_name", "transcript": "transcript_id", "exon": "exon_id", "CDS": "transcript_id"}
+
+class SortedIntervals:
+  #closed [start, end] intervals with names (e.g. genes of one contig), sorted by start.
+  #An interval covering a position starts at most max_length before it, so each query only
+  #checks the intervals between two np.searchsorted bounds, for a whole batch of positions at once.
+
+  def __init__(self, starts, ends, names):
+    order = np.argsort(starts, kind="stable")
+    self.starts = np.asarray(starts, dtype=np.int64)[order]
+    self.ends = np.asarray(ends, dtype=np.int64)[order]
+    self.names = np.asarray(names, dtype=object)[order]
+    self.max_length = int((self.ends - self.starts).max()) if len(self.starts) else 0
+
+  def __len__(self):
+    return len(self.starts)
+
+  def query(self, positions):
+    #sorted distinct names of the intervals covering every position, as a list of lists
+    positions = np.asarray(positions, dtype=np.int64)
+    upper = np.searchsorted(self.starts, positions, side="right")
+    lower = np.searchsorted(self.starts, positions - self.max_length, side="left")
+
+    #flatten all candidate (position, interval) pairs and keep the covering ones
+    counts = upper - lower
+    query_index = np.repeat(np.arange(len(positions)), counts)
+    candidates = np.repeat(lower - np.cumsum(np.concatenate(([0], counts[:-1]))), counts) + np.arange(counts.sum())
+    covering = self.ends[candidates] >= positions[query_index]
+    query_index, candidates = query_index[covering], candidates[covering]
+
+    results = [[] for _ in range(len(positions))]
+    for i, name in zip(query_index.tolist(), self.names[candidates]):
+      if name != "" and name is not None:
+        results[i].append(name)
+    return [sorted(set(names)) for names in results]
+
+def readGTF(gtf_path, features=("gene", "exon"), chunksize=500000):
+  #reads the intervals of some feature types from a GTF(.gz) file, in chunks to bound memory.
+  #Returns a feature/contig/start/end/name table, 'chr' prefixes are dropped like in Ensembl
+  pieces = []
+  reader = pd.read_csv(gtf_path, sep="\t", comment="#", header=None, names=GTF_COLUMNS,
+                       usecols=["seqname", "feature", "start", "end", "attribute"],
+                       dtype={"seqname": str, "feature": str, "attribute": str}, chunksize=chunksize)
+  with reader:
+    for chunk in reader:
+      chunk = chunk[chunk["feature"].isin(features)]
+      for feature, rows in chunk.groupby("feature"):
+        attribute = FEATURE_NAMES.get(feature, "gene_id")
+        pieces.append(pd.DataFrame({
+          "feature": feature,
+          "contig": rows["seqname"].str.replace(r"^chr", "", regex=True),
+          "start": rows["start"].astype(np.int64),
+          "end": rows["end"].astype(np.int64),
+          "name": rows["attribute"].str.extract(f'{attribute} "([^"]*)"', expand=False).fillna(""),
+        }))
+  if not pieces:
+    return pd.DataFrame(columns=["feature", "contig", "start", "end", "name"])
+  return pd.concat(pieces, ignore_index=True).drop_duplicates()
+
+class GTFAnnotator:
+  #per-feature, per-contig SortedIntervals built from a local GTF. The index can be saved to a
+  #compressed .npz file (save/load), which loads in a fraction of the time of re-reading the GTF.
+
+  def __init__(self, intervals):
+    #intervals is a feature/contig/start/end/name table, as returned by readGTF
+    self.features = sorted(intervals["feature"].unique())
+    self._indexes = {}
+    for (feature, contig), rows in intervals.groupby(["feature", "contig"]):
+      self._indexes[(feature, contig)] = SortedIntervals(rows["start"].to_numpy(), rows["end"].to_numpy(), rows["name"].to_numpy())
+
+  @classmethod
+  def fromGTF(cls, gtf_path, features=("gene", "exon")):
+    return cls(readGTF(gtf_path, features=features))
+
+  def save(self, index_path):
+    #one set of contig/start/end/name arrays per feature, without pickled objects. The index is written to
+    #a temporary file of this process and moved in place, so a reader never finds a half-written index
+    arrays = {}
+    for feature in self.features:
+      indexes = [(contig, index) for (index_feature, contig), index in self._indexes.items() if index_feature == feature]
+      arrays[f"{feature}.contig"] = np.concatenate([np.full(len(index), contig) for contig, index in indexes]).astype(str)
+      arrays[f"{feature}.start"] = np.concatenate([index.starts for _, index in indexes])
+      arrays[f"{feature}.end"] = np.concatenate([index.ends for _, index in indexes])
+      arrays[f"{feature}.name"] = np.concatenate([index.names for _, index in indexes]).astype(str)
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+      with open(temp_path, "wb") as index_file:
+        np.savez_compressed(index_file, **arrays)
+      os.replace(temp_path, index_path)
+    finally:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+  @classmethod
+  def load(cls, index_path):
+    frames = []
+    with np.load(index_path) as arrays:
+      features = sorted({key.rsplit(".", 1)[0] for key in arrays.files})
+      for feature in features:
+        frames.append(pd.DataFrame({"feature": feature,
+                                    "contig": arrays[f"{feature}.contig"],
+                                    "start": arrays[f"{feature}.start"],
+                                    "end": arrays[f"{feature}.end"],
+                                    "name": arrays[f"{feature}.name"]}))
+    return cls(pd.concat(frames, ignore_index=True))
+
+  def query(self, feature, contigs, positions):
+    #names of the features of one type covering every (contig, position), as a list of lists
+    if feature not in self.features:
+      raise ValueError(f"Feature {feature} is not in the index, available: {self.features}")
+    contigs = pd.Series(contigs).astype(str).str.replace(r"^chr", "", regex=True).to_numpy()
+    positions = np.asarray(positions, dtype=np.int64)
+    results = [[] for _ in range(len(positions))]
+    for contig in pd.unique(contigs):
+      if (feature, contig) not in self._indexes:
+        continue
+      rows = np.flatnonzero(contigs == contig)
+      for row, names in zip(rows, self._indexes[(feature, contig)].query(positions[rows])):
+        results[row] = names
+    return results
+
+  def annotate(self, contigs, positions):
+    #gene names and exon ids at every (contig, position), like EnsemblAnnotator.annotate
+    return self.query("gene", contigs, positions), self.query("exon", contigs, positions)
+
+#one annotator per GTF and process, see getGTFAnnotator
+_GTF_ANNOTATORS = {}
+
+def getGTFAnnotator(gtf_path, index_path=None, features=("gene", "exon")):
+  #returns the annotator of a GTF, loading it only once per process. The index is read from
+  #index_path (default: gtf_path + '.index.npz') if it is there, newer than the GTF and has all features,
+  #otherwise it is built from the GTF and saved there.
+  if index_path is None:
+    index_path = gtf_path + ".index.npz"
+  if index_path not in _GTF_ANNOTATORS:
+    annotator = None
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(gtf_path):
+      annotator = GTFAnnotator.load(index_path)
+      if not set(features).issubset(annotator.features):
+        annotator = None
+    if annotator is None:
+      print(f"Building the annotation index of {gtf_path}...")
+      annotator = GTFAnnotator.fromGTF(gtf_path, features=features)
+      try:
+        annotator.save(index_path)
+      except OSError as error:
+        #e.g. a read-only shared reference directory, the index is then rebuilt by the next run
+        print(f"WARNING! Couldn't save the annotation index to {index_path} ({error}), using it from memory")
+    _GTF_ANNOTATORS[index_path] = annotator
+  return _GTF_ANNOTATORS[index_path]
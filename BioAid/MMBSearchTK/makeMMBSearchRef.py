@@ -1,46 +1,218 @@
 # This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
+## Contents:
+## renameReferenceHeader
+## openFastaBinary
+## iterFastaBlocks
+## updateFaiRecord
+## formatFaiRecord
+## splitReferencePath
+## writeChromosomeFile
+## createMMBSearchReference
+
+import gzip
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import regex as re
 
-def createMMBSearchReference(file_path_in, file_path_out):
-  #good for human genome
-  file_in = open(file_path_in, "r")
-  save=False
-  readlines=True
-  while readlines:
-    try:
-      line = file_in.readline()
-    except:
-      print("Failed to read line. EOF? Exiting...")
-      readlines=False
-      break
-
-    if line[0] == ">":
-      if re.search("chromosome.*Primary.Assembly$", line) != None:
-        print(line)
-        linewords = line.split()
-        chromosome=linewords[4].strip(",")
-        if (chromosome=="1") | (chromosome=="2"):
-          chromosome=f">chr0{chromosome}\n"
-        elif chromosome=="X":
-          chromosome=f">chrX\n"
-        elif chromosome=="Y":
-          chromosome=f">chrY\n"
-        else:
-          chromosome=f">chr{chromosome}\n"
-        line=chromosome
-        print(line)
-        save=True
-      #fix for mitochondrial chr
-      elif re.search("mitochondrion, complete genome$", line) != None:
-        print(line)
-        line=f">chrM\n"
-        print(line)
-        save=True
+#kept records: primary assembly chromosomes and the mitochondrial genome (good for human genome)
+PRIMARY_CHROMOSOME = re.compile("chromosome.*Primary.Assembly$")
+MITOCHONDRION = re.compile("mitochondrion, complete genome$")
+
+#the input is read and the output written in blocks of this many bytes
+BLOCK_SIZE = 16 * 1024 * 1024
+
+#blocks waiting for each per-chromosome writer thread, bounds the memory of slow writers
+WRITER_QUEUE_BLOCKS = 4
+
+#split_dir layouts: split_dir/chrN.fa or the split_dir/chrN/chrN.fa directories of MMBSearch runs
+SPLIT_LAYOUTS = ("flat", "directory")
+
+def renameReferenceHeader(header):
+  #MMBSearch name of a FASTA header line (e.g. '>NC_000001.11 Homo sapiens chromosome 1, GRCh38.p14
+  #Primary Assembly' -> 'chr01'), None if the record is not kept
+  header = header.rstrip("\r\n")
+  if PRIMARY_CHROMOSOME.search(header) != None:
+    chromosome = header.split()[4].strip(",")
+    if (chromosome=="1") | (chromosome=="2"):
+      return f"chr0{chromosome}"
+    return f"chr{chromosome}"
+  #fix for mitochondrial chr
+  if MITOCHONDRION.search(header) != None:
+    return "chrM"
+  return None
+
+def openFastaBinary(file_path):
+  #FASTA(.gz) opened for binary reading
+  if file_path.endswith(".gz"):
+    return gzip.open(file_path, "rb")
+  return open(file_path, "rb")
+
+def iterFastaBlocks(file_in, block_size=BLOCK_SIZE):
+  #splits a binary FASTA stream into (header, None) and (None, sequence bytes) pieces. Sequence pieces
+  #are up to block_size bytes of whole lines, so records are copied in large chunks, never line by line
+  carry = b""
+  while True:
+    block = file_in.read(block_size)
+    if not block:
+      data = carry
+    else:
+      data = carry + block
+      last_newline = data.rfind(b"\n")
+      if last_newline < 0:
+        carry = data
+        continue
+      data, carry = data[:last_newline + 1], data[last_newline + 1:]
+
+    #data starts at a line start and ends with a whole line
+    position = 0
+    while position < len(data):
+      if data.startswith(b">", position):
+        header_end = data.find(b"\n", position)
+        header_end = len(data) if header_end < 0 else header_end + 1
+        yield data[position:header_end].decode(), None
+      else:
+        next_header = data.find(b"\n>", position)
+        header_end = len(data) if next_header < 0 else next_header + 1
+        yield None, data[position:header_end]
+      position = header_end
+
+    if not block:
+      return
+
+def updateFaiRecord(record, sequence):
+  #adds a block of sequence lines to a .fai record (name/length/offset/linebases/linewidth dict)
+  if record["linebases"] is None:
+    first_line = sequence[:sequence.find(b"\n") + 1] if b"\n" in sequence else sequence
+    record["linewidth"] = len(first_line)
+    record["linebases"] = len(first_line.rstrip(b"\r\n"))
+  record["length"] += len(sequence) - sequence.count(b"\n") - sequence.count(b"\r")
+
+def formatFaiRecord(record):
+  return f"{record['name']}\t{record['length']}\t{record['offset']}\t{record['linebases'] or 0}\t{record['linewidth'] or 0}\n"
+
+def splitReferencePath(split_dir, chromosome, split_layout="flat", compress=False):
+  #path of a per-chromosome FASTA. The directory layout drops the padding zero of chr01/chr02,
+  #so the files land in the chr1, chr2, ... directories used by MMBSearch and createAnnotatedOutput
+  file_name = f"{chromosome}.fa.gz" if compress else f"{chromosome}.fa"
+  if split_layout == "directory":
+    return os.path.join(split_dir, re.sub("^chr0", "chr", chromosome), file_name)
+  return os.path.join(split_dir, file_name)
+
+def writeChromosomeFile(file_path, chromosome, blocks, fai=False, compress=False, block_size=BLOCK_SIZE):
+  #writer thread: writes the blocks of one chromosome from a queue (None ends it) to its own FASTA.
+  #With compress the queue holds futures of gzip members, compressed in parallel by the thread pool
+  #(zlib releases the GIL) and written here in order; concatenated members are a valid .gz file.
+  #Uncompressed files get their own .fai index. Returns the file path.
+  os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+  header = f">{chromosome}\n".encode()
+  record = {"name": chromosome, "length": 0, "offset": len(header), "linebases": None, "linewidth": None}
+  with open(file_path, "wb", buffering=block_size) as file_out:
+    file_out.write(gzip.compress(header) if compress else header)
+    while True:
+      block = blocks.get()
+      if block is None:
+        break
+      if compress:
+        file_out.write(block.result())
       else:
-        save=False
+        file_out.write(block)
+        updateFaiRecord(record, block)
+  if fai and not compress:
+    with open(file_path + ".fai", "w") as fai_out:
+      fai_out.write(formatFaiRecord(record))
+  return file_path
+
+def _putBlock(blocks, writer, sequence):
+  #hands a block to a writer thread without blocking forever if the writer has failed
+  while True:
+    try:
+      blocks.put(sequence, timeout=1)
+      return
+    except queue.Full:
+      if writer.done():
+        writer.result()
+        raise RuntimeError("Chromosome writer stopped before the end of its sequence")
+
+def createMMBSearchReference(file_path_in, file_path_out, fai=False, split_dir=None, block_size=BLOCK_SIZE,
+                             split_layout="flat", compress_split=False, writer_threads=4):
+  #writes the primary chromosomes and chrM of a (gzipped) FASTA, renamed for MMBSearch, to file_path_out
+  #(overwritten, not appended to; None to only split). Kept records are copied block by block in a single pass.
+  #fai=True also writes samtools-style .fai indexes. split_dir writes one FASTA per chromosome, in the
+  #split_layout of SPLIT_LAYOUTS, gzipped if compress_split; the per-chromosome files are written
+  #while the input is being read, their blocks compressed by up to writer_threads threads.
+  #Returns the kept chromosome names.
+  if split_layout not in SPLIT_LAYOUTS:
+    raise ValueError(f"split_layout must be one of {SPLIT_LAYOUTS}")
+  if split_dir is not None:
+    os.makedirs(split_dir, exist_ok=True)
+
+  kept = []
+  index = []
+  chromosome, record = None, None
+  blocks, writer, writers = None, None, []
+  #writers wait on compression futures, so they get their own pool to not starve the compressors
+  executor = ThreadPoolExecutor(max_workers=max(writer_threads, 1)) if split_dir is not None else None
+  compressor = ThreadPoolExecutor(max_workers=max(writer_threads, 1)) if split_dir is not None and compress_split else None
+  file_out = open(file_path_out, "wb", buffering=block_size) if file_path_out is not None else None
+  try:
+    with openFastaBinary(file_path_in) as file_in:
+      for header, sequence in iterFastaBlocks(file_in, block_size):
+        if header is not None:
+          if blocks is not None:
+            _putBlock(blocks, writer, None)
+            blocks = None
+          chromosome = renameReferenceHeader(header)
+          if chromosome is None:
+            record = None
+            continue
+          print(header)
+          print(f">{chromosome}\n")
+          kept.append(chromosome)
+          if file_out is not None:
+            file_out.write(f">{chromosome}\n".encode())
+            record = {"name": chromosome, "length": 0, "offset": file_out.tell(), "linebases": None, "linewidth": None}
+            index.append(record)
+          if executor is not None:
+            blocks = queue.Queue(maxsize=WRITER_QUEUE_BLOCKS * max(writer_threads, 1))
+            split_path = splitReferencePath(split_dir, chromosome, split_layout, compress_split)
+            writer = executor.submit(writeChromosomeFile, split_path, chromosome, blocks, fai, compress_split, block_size)
+            writers.append(writer)
+          continue
+
+        if chromosome is None:
+          continue
+        if file_out is not None:
+          file_out.write(sequence)
+          updateFaiRecord(record, sequence)
+        if blocks is not None:
+          _putBlock(blocks, writer, compressor.submit(gzip.compress, sequence, 6) if compressor is not None else sequence)
+
+      if blocks is not None:
+        _putBlock(blocks, writer, None)
+        blocks = None
+  finally:
+    if file_out is not None:
+      file_out.close()
+    if blocks is not None:
+      #the input failed mid-chromosome, let its writer finish so the threads can shut down
+      try:
+        _putBlock(blocks, writer, None)
+      except RuntimeError:
+        pass
+    if executor is not None:
+      executor.shutdown(wait=True)
+    if compressor is not None:
+      compressor.shutdown(wait=True)
+
+  #re-raises any writer error
+  for writer in writers:
+    writer.result()
 
-    if save:
-      with open(file_path_out, "a") as file_out:
-        file_out.write(line)
\ No newline at end of file
+  if fai and file_path_out is not None:
+    with open(file_path_out + ".fai", "w") as fai_out:
+      for record in index:
+        fai_out.write(formatFaiRecord(record))
+  return kept
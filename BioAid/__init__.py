@@ -1,13 +1,30 @@
 # This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
-from .base import *
-from .diluter import dilute
-from .popDub import calculatePopulationDoublings
-from .repeatSearch import searchSequenceForRepeats
-from .Kmers import runOligoFreqAnalysis
-from .complexity import *
-from .MMBSearchTK import *
-from .deepSeqInsH import *
-from .variantTK import *
-from .paralleltools import *
\ No newline at end of file
+from . import MMBSearchTK, deepSeqInsH, variantTK
+from .lazyImports import attachLazyImports
+
+#Submodules are only imported when one of their names is first used (e.g. BioAid.rev_compl imports base
+#alone), so `import BioAid` does not load pandas, matplotlib etc. The sub-packages are lazy the same way.
+#Check the import time with lazyImports.checkImportTime()
+__getattr__, __dir__, __all__ = attachLazyImports(__name__,
+  ['base', 'diluter', 'popDub', 'repeatSearch', 'Kmers', 'complexity', 'makeMMBSearchRef', 'paralleltools'], {
+  '.base': ['logger', 'extractSeqFromFastaToList', 'getSequenceLengths', 'validateSquence', 'compl', 'rev_compl',
+            'unique', 'createChrList', 'dataFrameImport', 'pullGenomicContext', 'drawGenomicContext'],
+  '.diluter': ['dilute'],
+  '.popDub': ['calculatePopulationDoublings'],
+  '.repeatSearch': ['searchSequenceForRepeats'],
+  '.Kmers': ['runOligoFreqAnalysis'],
+  '.complexity': ['wordsInSequence', 'findComplexity', 'movingWindow', 'createLogFile', 'createSequenceList',
+                  'createDataFrameFromLogFile'],
+  '.MMBSearchTK': MMBSearchTK.__all__,
+  '.deepSeqInsH': deepSeqInsH.__all__,
+  '.variantTK': variantTK.__all__,
+  '.paralleltools': ['logger', 'SLICE_FORMATS', 'slicePath', 'writeSlice', 'readSlice', 'makeScratchDir', 'splitDF',
+                     'joinSlices', 'cleanUpSlices', 'fileChecksum', 'newManifest', 'loadManifest', 'saveManifest',
+                     'resumeManifest', 'isSliceDone', 'iterCSVChunks', 'JointWriter', 'availableCPUs',
+                     'availableMemory', 'recommendNumProcesses', 'buildRunReport', 'saveRunReport',
+                     'runScriptSubprocess', 'runScriptMeasured', 'runSliceWithRetries', 'runMainPool',
+                     'runStreamingPool', 'claimSlice', 'releaseSlice', 'queueStatus', 'initQueue', 'runQueueWorker',
+                     'runQueueWorkers', 'joinQueue', 'parseArguments', 'main'],
+})
\ No newline at end of file
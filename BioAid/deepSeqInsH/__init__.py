@@ -1,4 +1,13 @@
 # This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
-from .annoInsH import *
\ No newline at end of file
+from ..lazyImports import attachLazyImports
+
+#submodules are only imported when one of their names is first used
+__getattr__, __dir__, __all__ = attachLazyImports(__name__, ['annoInsH', 'consensusClassifier'], {
+  '.annoInsH': ['QUALITY_MODES', 'packQualities', 'unpackQualities', 'iterReadChunks', 'readAlignmentFile',
+                'iterSampleChunks', 'dataFrameImport', 'matchSequence', 'findReadLength', 'trimseq', 'classify',
+                'collapseReads', 'expandCollapsed', 'trimseqCollapsed', 'classifyCollapsed', 'trimAndClassifyReads',
+                'primerVariants', 'primerSeeds', 'findPrimer', 'trimPrimers'],
+  '.consensusClassifier': ['buildPeq', 'myersSearchDistance', 'ConsensusClassifier', 'classifyReadsMulti'],
+})
\ No newline at end of file
@@ -2,34 +2,115 @@
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
 ## Contents:
+## packQualities
+## unpackQualities
+## iterReadChunks
+## readAlignmentFile
+## iterSampleChunks
 ## dataFrameImport
 ## matchSequence
 ## findReadLength
 ## trimseq
 ## classify
+## collapseReads
+## expandCollapsed
+## trimseqCollapsed
+## classifyCollapsed
+## trimAndClassifyReads
+## primerVariants
+## primerSeeds
+## findPrimer
+## trimPrimers
 
 import regex as re
 import os
+import numpy as np
 import pandas as pd
+import itertools
+from .consensusClassifier import ConsensusClassifier, classifyReadsMulti
 
-def dataFrameImport(directory,datatype = 'sam'):
+#how read qualities are stored: 'array' keeps pysam's array per read, 'packed' stores them as
+#bytes (one uint8 per base, see unpackQualities) and 'none' drops the qual column
+QUALITY_MODES = ('array', 'packed', 'none')
+
+def packQualities(qualities):
+  #pysam query_qualities (array of uint8) to a compact bytes buffer, None stays None
+  return None if qualities is None else qualities.tobytes()
+
+def unpackQualities(packed):
+  #packed qualities back to a numpy uint8 array
+  return None if packed is None else np.frombuffer(packed, dtype=np.uint8)
+
+def iterReadChunks(path, chunksize=1000000, qualities='packed', threads=1):
+  #streams a SAM/BAM file as DataFrames of up to chunksize reads (name, seq and, unless qualities='none', qual).
+  #Reads are taken in file order without needing an index; threads are BAM decompression threads
   import pysam
 
-  #This function imports all files inside of the specified DIR path into two lists; of panda DF and sample names
-  frames_list_samples = []
-  sample_names = []
+  if qualities not in QUALITY_MODES:
+    raise ValueError(f"qualities must be one of {QUALITY_MODES}")
+
+  names, seqs, quals = [], [], []
+  with pysam.AlignmentFile(path, check_sq=False, threads=threads) as alignment_file:
+    for read in alignment_file.fetch(until_eof=True):
+      names.append(read.query_name)
+      seqs.append(read.query_sequence)
+      if qualities == 'array':
+        quals.append(read.query_qualities)
+      elif qualities == 'packed':
+        quals.append(packQualities(read.query_qualities))
+      if len(names) == chunksize:
+        yield _readChunkFrame(names, seqs, quals, qualities)
+        names, seqs, quals = [], [], []
+  if names:
+    yield _readChunkFrame(names, seqs, quals, qualities)
 
-  counter=1
+def _readChunkFrame(names, seqs, quals, qualities):
+  columns = {'name': names, 'seq': seqs}
+  if qualities != 'none':
+    columns['qual'] = quals
+  return pd.DataFrame(columns)
 
-  #import all files in the directory
+def readAlignmentFile(args):
+  #reads one whole SAM/BAM file chunk by chunk, args are (path, chunksize, qualities, threads) for pool workers
+  path, chunksize, qualities, threads = args
+  chunks = list(iterReadChunks(path, chunksize=chunksize, qualities=qualities, threads=threads))
+  if not chunks:
+    return _readChunkFrame([], [], [], qualities)
+  return pd.concat(chunks, ignore_index=True)
+
+def _findSampleFiles(directory, datatype):
+  #sample names and paths of the .sam/.bam files of a directory
+  sample_names, paths = [], []
   for filename in os.listdir(directory):
-      if filename.endswith(f".{datatype}"):
-          sample_names.append(filename[:8].strip())
-          path = os.path.join(directory, filename)
-          globals()[f"sample{counter}"] = pd.DataFrame(({'name': x.qname, 'seq': x.seq, 'qual': x.query_qualities} for x in pysam.Samfile(path).fetch()))
-          print(f'dataframe {sample_names[-1]} has {len(globals()[f"sample{counter}"])} total rows')
-          frames_list_samples.append(globals()[f"sample{counter}"])
-          counter+=1
+    if filename.endswith(f".{datatype}"):
+      sample_names.append(filename[:8].strip())
+      paths.append(os.path.join(directory, filename))
+  return sample_names, paths
+
+def iterSampleChunks(directory, datatype='sam', chunksize=1000000, qualities='packed', threads=1):
+  #streams every sample of a directory as (sample name, DataFrame of up to chunksize reads) pairs,
+  #so runs with tens of millions of reads can be processed without holding them all in memory
+  for sample_name, path in zip(*_findSampleFiles(directory, datatype)):
+    for chunk in iterReadChunks(path, chunksize=chunksize, qualities=qualities, threads=threads):
+      yield sample_name, chunk
+
+def dataFrameImport(directory, datatype = 'sam', qualities='array', num_processes=1, chunksize=1000000, threads=1):
+  #This function imports all files inside of the specified DIR path into two lists; of panda DF and sample names.
+  #qualities is one of QUALITY_MODES ('packed' or 'none' need much less memory than pysam arrays),
+  #num_processes > 1 reads the sample files in parallel, threads are BAM decompression threads per file.
+  #For runs too large for memory stream them with iterSampleChunks instead.
+  sample_names, paths = _findSampleFiles(directory, datatype)
+  tasks = [(path, chunksize, qualities, threads) for path in paths]
+
+  if num_processes > 1 and len(tasks) > 1:
+    from multiprocessing import Pool
+    with Pool(min(num_processes, len(tasks))) as pool:
+      frames_list_samples = pool.map(readAlignmentFile, tasks)
+  else:
+    frames_list_samples = [readAlignmentFile(task) for task in tasks]
+
+  for sample_name, df in zip(sample_names, frames_list_samples):
+    print(f'dataframe {sample_name} has {len(df)} total rows')
   print(f"found {len(frames_list_samples)} samples in {directory}")
   print(len(sample_names), sample_names)
 
@@ -79,4 +160,156 @@ def classify(row, consensus, classification):
   if re.search('('+row.seq+')'+'{e<=2}', consensus):
   #if row.seq in consensus:
     row.classification = classification
-  return row
\ No newline at end of file
+  return row
+
+def collapseReads(df, columns=('seq',)):
+  #collapses reads to the unique combinations of columns, with a count column.
+  #Also returns, for every read, the row of its unique combination (see expandCollapsed)
+  columns = list(columns)
+  if len(columns) == 1:
+    codes, uniques = pd.factorize(df[columns[0]], use_na_sentinel=False)
+    unique_df = pd.DataFrame({columns[0]: uniques})
+  else:
+    codes, uniques = pd.factorize(pd.MultiIndex.from_frame(df[columns]), use_na_sentinel=False)
+    unique_df = uniques.to_frame(index=False, name=columns)
+  unique_df['count'] = np.bincount(codes, minlength=len(unique_df))
+  return unique_df, codes
+
+def expandCollapsed(df, unique_df, codes, columns):
+  #copies columns of the unique rows back to every read of df
+  df = df.copy()
+  for column in columns:
+    df[column] = unique_df[column].to_numpy()[codes]
+  return df
+
+def trimseqCollapsed(df, f_seq, r_seq, consensus):
+  #trimseq run once per unique seq/primer flags combination instead of once per read
+  keys = ['seq', 'forward_primer', 'reverse_primer']
+  unique_df, codes = collapseReads(df, keys)
+  unique_df = unique_df.apply(lambda row: trimseq(row, f_seq, r_seq, consensus), axis=1)
+  print(f"trimmed {len(unique_df)} unique sequences of {len(df)} reads")
+  return expandCollapsed(df, unique_df, codes, keys)
+
+def classifyCollapsed(df, consensus, classification):
+  #classify run once per unique seq/classification combination instead of once per read
+  unique_df, codes = collapseReads(df, ['seq', 'classification'])
+  unique_df = unique_df.apply(lambda row: classify(row, consensus, classification), axis=1)
+  return expandCollapsed(df, unique_df, codes, ['classification'])
+
+def trimAndClassifyReads(df, f_seq, r_seq, consensus, classifications, expand=True, num_processes=1, mismatches=0):
+  #trims the reads (trimPrimers, mismatches allowed in the primers) and classifies them against
+  #(consensus, classification) pairs in order (like classify, with the indexed classifyReadsMulti), each step
+  #on unique sequences only. Identical reads are collapsed before trimming and again after it, when reads that
+  #differed only outside the primers converge. The primers are searched in every read, so forward_primer and
+  #reverse_primer columns from matchSequence are not needed and are replaced.
+  #Returns the per-read table if expand, otherwise the unique trimmed sequences with their read counts.
+  df = df.copy()
+  trimmed = trimPrimers(df['seq'], f_seq, r_seq, consensus, mismatches=mismatches)
+  for column in ['seq', 'forward_primer', 'reverse_primer']:
+    df[column] = trimmed[column]
+  if 'classification' not in df.columns:
+    df['classification'] = "other"
+
+  keys = ['seq', 'forward_primer', 'reverse_primer', 'classification']
+  unique_df, codes = collapseReads(df, keys)
+  print(f"classifying {len(unique_df)} unique trimmed sequences of {len(df)} reads")
+  unique_df = classifyReadsMulti(unique_df, classifications, num_processes=num_processes)
+
+  if expand:
+    return expandCollapsed(df, unique_df, codes, ['classification'])
+  return unique_df.groupby(keys, sort=False, dropna=False, as_index=False)['count'].sum()
+
+def primerVariants(primer, mismatches=1, alphabet="ACGTN"):
+  #all sequences within mismatches substitutions of a primer (the primer included), precomputed once for findPrimer.
+  #N is in the alphabet, so an uncalled base in a read counts as one mismatch
+  variants = {primer}
+  for n in range(1, mismatches + 1):
+    for positions in itertools.combinations(range(len(primer)), n):
+      for bases in itertools.product(alphabet, repeat=n):
+        variant = list(primer)
+        for position, base in zip(positions, bases):
+          variant[position] = base
+        variants.add("".join(variant))
+  return frozenset(variants)
+
+def primerSeeds(primer, mismatches=1):
+  #(offset, piece) pairs cutting the primer into mismatches+1 pieces, one of which a variant holds unchanged.
+  #None if the primer is too short to cut
+  pieces = mismatches + 1
+  piece_length = len(primer) // pieces
+  if piece_length == 0:
+    return None
+  seeds = [(offset, primer[offset:offset + piece_length]) for offset in range(0, piece_length * (pieces - 1), piece_length)]
+  seeds.append((piece_length * (pieces - 1), primer[piece_length * (pieces - 1):]))
+  return seeds
+
+def findPrimer(seq, primer, variants=None, seeds=None):
+  #leftmost start of the primer (or, given primerVariants and primerSeeds, of any of its variants) in seq, -1 if none.
+  #Variant windows are only checked where a seed piece occurs exactly
+  if variants is None:
+    return seq.find(primer)
+  length = len(primer)
+  if seeds is None:
+    for start in range(len(seq) - length + 1):
+      if seq[start:start + length] in variants:
+        return start
+    return -1
+
+  best = -1
+  for offset, piece in seeds:
+    index = seq.find(piece)
+    while index != -1:
+      start = index - offset
+      if best != -1 and start >= best:
+        break
+      if start >= 0 and seq[start:start + length] in variants:
+        best = start
+        break
+      index = seq.find(piece, index + 1)
+  return best
+
+def trimPrimers(seqs, f_seq, r_seq, consensus=None, mismatches=0, max_errors=2):
+  #trimseq for a whole Series of reads: returns a seq/forward_primer/reverse_primer table aligned with seqs.
+  #Reads are trimmed to the forward primer start and the end of the first reverse primer after it; a primer
+  #that is not found leaves its side untrimmed and its flag False, reads without both are "no_primers".
+  #mismatches allows substitutions in the primers. With a consensus, trimmed reads it contains with
+  #<= max_errors edits are "no_excision". Each distinct read is trimmed once and summary counts are
+  #printed (and kept in .attrs['summary']) instead of a message per read.
+  seqs = pd.Series(seqs)
+  codes, uniques = pd.factorize(seqs, use_na_sentinel=False)
+  f_variants = primerVariants(f_seq, mismatches) if mismatches else None
+  r_variants = primerVariants(r_seq, mismatches) if mismatches else None
+  f_seeds = primerSeeds(f_seq, mismatches) if mismatches else None
+  r_seeds = primerSeeds(r_seq, mismatches) if mismatches else None
+
+  trimmed, forward, reverse = [], np.zeros(len(uniques), dtype=bool), np.zeros(len(uniques), dtype=bool)
+  for i, seq in enumerate(uniques):
+    f_index = findPrimer(seq, f_seq, f_variants, f_seeds)
+    if f_index != -1:
+      forward[i] = True
+      seq = seq[f_index:]
+    r_index = findPrimer(seq, r_seq, r_variants, r_seeds)
+    if r_index != -1:
+      reverse[i] = True
+      seq = seq[:r_index + len(r_seq)]
+    trimmed.append(seq if forward[i] or reverse[i] else "no_primers")
+  trimmed = np.asarray(trimmed, dtype=object)
+
+  no_excision = np.zeros(len(uniques), dtype=bool)
+  if consensus is not None:
+    classifier = ConsensusClassifier([(consensus, "no_excision")], max_errors=max_errors)
+    no_excision = classifier.classifySequences(trimmed) == "no_excision"
+    trimmed[no_excision] = "no_excision"
+
+  df = pd.DataFrame({'seq': trimmed[codes], 'forward_primer': forward[codes], 'reverse_primer': reverse[codes]}, index=seqs.index)
+  counts = np.bincount(codes, minlength=len(uniques))
+  summary = {'reads': len(seqs),
+             'unique': len(uniques),
+             'forward_primer': int(counts[forward].sum()),
+             'reverse_primer': int(counts[reverse].sum()),
+             'no_primers': int(counts[~forward & ~reverse].sum()),
+             'no_excision': int(counts[no_excision].sum())}
+  df.attrs['summary'] = summary
+  print(f"trimmed {summary['reads']} reads ({summary['unique']} unique): {summary['forward_primer']} with a forward primer, "
+        f"{summary['reverse_primer']} with a reverse primer, {summary['no_primers']} without primers, {summary['no_excision']} no excision")
+  return df
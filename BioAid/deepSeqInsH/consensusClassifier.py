@@ -0,0 +1,139 @@
+# This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
+# Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
+
+## Contents:
+## buildPeq
+## myersSearchDistance
+## ConsensusClassifier
+## classifyReadsMulti
+
+import numpy as np
+import pandas as pd
+
+#Classifies reads against a whole list of (consensus, classification) pairs in one pass, with the same
+#result as applying classify once per pair: a read gets the label of the first consensus that contains
+#it with at most max_errors edits (substitutions, insertions or deletions), otherwise it stays "other".
+#Consensuses are indexed by k-mers: a read with <= max_errors edits has max_errors+1 disjoint pieces and
+#one of them occurs exactly, so only consensuses holding all the k-mers of some piece are verified,
+#each with Myers' bit-parallel edit distance (one Python int operation per consensus base, not per cell).
+
+def buildPeq(pattern):
+  #Myers' match masks of a pattern: bit i of peq[c] is set where pattern[i] == c
+  peq = {}
+  for i, c in enumerate(pattern):
+    peq[c] = peq.get(c, 0) | (1 << i)
+  return peq
+
+def myersSearchDistance(peq, m, text, max_errors=None):
+  #smallest edit distance between a pattern (peq of buildPeq, length m) and any substring of text.
+  #Stops early once it is <= max_errors
+  if m == 0:
+    return 0
+  full = (1 << m) - 1
+  last = 1 << (m - 1)
+  pv, mv, score = full, 0, m
+  best = m
+  for c in text:
+    eq = peq.get(c, 0)
+    xv = eq | mv
+    xh = ((((eq & pv) + pv) & full) ^ pv) | eq
+    ph = mv | (~(xh | pv) & full)
+    mh = pv & xh
+    if ph & last:
+      score += 1
+    elif mh & last:
+      score -= 1
+    #the match may start anywhere in the text, so nothing is shifted in
+    ph = (ph << 1) & full
+    mh = (mh << 1) & full
+    pv = mh | (~(xv | ph) & full)
+    mv = ph & xv
+    if score < best:
+      best = score
+      if max_errors is not None and best <= max_errors:
+        return best
+  return best
+
+class ConsensusClassifier:
+  #(consensus, classification) pairs indexed by k-mers, see classifySequence.
+  #Reads shorter than (max_errors+1)*k pieces cannot be seeded and are verified against every consensus.
+
+  def __init__(self, classifications, max_errors=2, k=11, default="other"):
+    self.consensuses = [consensus for consensus, _ in classifications]
+    self.labels = [classification for _, classification in classifications]
+    self.max_errors = max_errors
+    self.k = k
+    self.default = default
+    #k-mer -> bit mask of the consensuses containing it
+    self.index = {}
+    for i, consensus in enumerate(self.consensuses):
+      for start in range(len(consensus) - k + 1):
+        kmer = consensus[start:start + k]
+        self.index[kmer] = self.index.get(kmer, 0) | (1 << i)
+    self.all_candidates = (1 << len(self.consensuses)) - 1
+
+  def candidates(self, seq):
+    #bit mask of the consensuses that can contain seq with <= max_errors edits
+    pieces = self.max_errors + 1
+    piece_length = len(seq) // pieces
+    if piece_length < self.k:
+      return self.all_candidates
+    candidates = 0
+    for piece in range(pieces):
+      start = piece * piece_length
+      piece_candidates = self.all_candidates
+      for kmer_start in range(start, start + piece_length - self.k + 1):
+        piece_candidates &= self.index.get(seq[kmer_start:kmer_start + self.k], 0)
+        if not piece_candidates:
+          break
+      candidates |= piece_candidates
+      if candidates == self.all_candidates:
+        break
+    return candidates
+
+  def classifySequence(self, seq):
+    #label of the first consensus containing seq with <= max_errors edits, default if none
+    candidates = self.candidates(seq)
+    if not candidates:
+      return self.default
+    peq = buildPeq(seq)
+    for i, consensus in enumerate(self.consensuses):
+      if candidates >> i & 1 and myersSearchDistance(peq, len(seq), consensus, self.max_errors) <= self.max_errors:
+        return self.labels[i]
+    return self.default
+
+  def classifySequences(self, seqs, num_processes=1, chunksize=10000):
+    #labels of many sequences as an object array, each distinct sequence classified once.
+    #num_processes > 1 splits the distinct sequences between worker processes
+    codes, uniques = pd.factorize(pd.Series(seqs, dtype=object), use_na_sentinel=False)
+    uniques = list(uniques)
+    if num_processes > 1 and len(uniques) > chunksize:
+      from multiprocessing import Pool
+      chunks = [uniques[i:i + chunksize] for i in range(0, len(uniques), chunksize)]
+      with Pool(min(num_processes, len(chunks)), initializer=_setClassifier, initargs=(self,)) as pool:
+        labels = [label for chunk_labels in pool.map(_classifyChunk, chunks) for label in chunk_labels]
+    else:
+      labels = [self.classifySequence(seq) for seq in uniques]
+    return np.asarray(labels, dtype=object)[codes]
+
+#the classifier of a worker process, see classifySequences
+_CLASSIFIER = None
+
+def _setClassifier(classifier):
+  global _CLASSIFIER
+  _CLASSIFIER = classifier
+
+def _classifyChunk(seqs):
+  return [_CLASSIFIER.classifySequence(seq) for seq in seqs]
+
+def classifyReadsMulti(df, classifications, max_errors=2, num_processes=1, k=11):
+  #classify for all (consensus, classification) pairs at once: reads still labelled "other" (or all reads
+  #if there is no classification column) get the label of the first consensus containing them
+  df = df.copy()
+  if 'classification' not in df.columns:
+    df['classification'] = "other"
+  todo = (df['classification'] == "other").to_numpy()
+  classifier = ConsensusClassifier(classifications, max_errors=max_errors, k=k)
+  labels = classifier.classifySequences(df['seq'].to_numpy()[todo], num_processes=num_processes)
+  df.loc[todo, 'classification'] = labels
+  return df
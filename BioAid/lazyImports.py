@@ -0,0 +1,64 @@
+# This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
+# Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
+
+## Contents:
+## attachLazyImports
+## measureImportTime
+## checkImportTime
+
+import importlib
+import sys
+
+#a bare `import BioAid` should stay below this many seconds and load none of HEAVY_MODULES
+IMPORT_TIME_BUDGET = 0.05
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib', 'seaborn', 'natsort', 'regex', 'pysam', 'pyensembl')
+
+def attachLazyImports(package_name, submodules, attributes):
+  #module-level __getattr__, __dir__ and __all__ for a package whose submodules are imported on first use.
+  #submodules are the names of its direct submodules, attributes maps relative module names (e.g. '.base')
+  #to the names taken from them; a name listed for several modules comes from the last one, like in a chain
+  #of star imports. Loaded attributes are stored in the package, so each is looked up only once.
+  origins = {}
+  for module_name, names in attributes.items():
+    for name in names:
+      origins[name] = module_name
+
+  def __getattr__(name):
+    if name in submodules:
+      value = importlib.import_module(f".{name}", package_name)
+    elif name in origins:
+      value = getattr(importlib.import_module(origins[name], package_name), name)
+    else:
+      raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+    setattr(sys.modules[package_name], name, value)
+    return value
+
+  def __dir__():
+    return sorted(set(vars(sys.modules[package_name])) | set(submodules) | set(origins))
+
+  return __getattr__, __dir__, list(submodules) + [name for name in origins if name not in submodules]
+
+def measureImportTime(module_name="BioAid", repeats=5):
+  #median import time (seconds) of a module in fresh interpreters, and the HEAVY_MODULES it loaded
+  import json
+  import statistics
+  import subprocess
+  code = ("import sys, time, json; start = time.perf_counter(); import " + module_name + "; "
+          "print(json.dumps([time.perf_counter() - start, [m for m in " + repr(HEAVY_MODULES) + " if m in sys.modules]]))")
+  times, loaded = [], set()
+  for _ in range(repeats):
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    seconds, modules = json.loads(result.stdout.strip().splitlines()[-1])
+    times.append(seconds)
+    loaded.update(modules)
+  return statistics.median(times), sorted(loaded)
+
+def checkImportTime(module_name="BioAid", budget=IMPORT_TIME_BUDGET, repeats=5):
+  #raises RuntimeError if importing the module takes longer than budget or loads any of HEAVY_MODULES
+  seconds, loaded = measureImportTime(module_name, repeats)
+  print(f"import {module_name}: {seconds*1000:.1f} ms (budget {budget*1000:.0f} ms)")
+  if loaded:
+    raise RuntimeError(f"import {module_name} loads heavy modules: {', '.join(loaded)}")
+  if seconds > budget:
+    raise RuntimeError(f"import {module_name} takes {seconds*1000:.1f} ms, over the {budget*1000:.0f} ms budget")
+  return seconds
@@ -1,57 +1,32 @@
 # This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
-import regex as re
+from .MMBSearchTK.makeMMBSearchRef import createMMBSearchReference as _createMMBSearchReference
+from .MMBSearchTK.makeMMBSearchRef import BLOCK_SIZE
 
-def createMMBSearchReference(file_path_in: str, file_path_out: str) -> None:
+def createMMBSearchReference(file_path_in: str, file_path_out: str, fai: bool = False, split_dir: str = None, block_size: int = BLOCK_SIZE,
+                             split_layout: str = "flat", compress_split: bool = False, writer_threads: int = 4) -> list:
     """
     Reads a FASTA file containing genome data and creates a new file with a modified header line for each chromosome.
     It's purpose is to create a FASTA file that can be used as a reference for MMBSearch.
+    Only the primary assembly chromosomes and the mitochondrial genome are kept, their sequences are copied
+    in large blocks in a single pass (see BioAid.MMBSearchTK.makeMMBSearchRef).
 
     Args:
-        file_path_in (str): The path to the input FASTA file.
-        file_path_out (str): The path to the output file to be created.
+        file_path_in (str): The path to the input FASTA file, may be gzipped (.gz).
+        file_path_out (str): The path to the output file to be created. An existing file is overwritten.
+            If None, only the per-chromosome files are written.
+        fai (bool): Also write samtools-style .fai indexes of the (uncompressed) outputs. Defaults to False.
+        split_dir (str): If given, also write one FASTA file per chromosome to this directory. Defaults to None.
+        block_size (int): Number of bytes read and written at a time. Defaults to 16 MB.
+        split_layout (str): 'flat' for split_dir/chrN.fa or 'directory' for split_dir/chrN/chrN.fa,
+            the per-chromosome directory layout of MMBSearch runs. Defaults to 'flat'.
+        compress_split (bool): Gzip the per-chromosome files. Defaults to False.
+        writer_threads (int): Number of threads writing (and compressing) the per-chromosome files. Defaults to 4.
 
     Returns:
-        None
+        list: The names of the kept chromosomes, e.g. ['chr01', 'chr02', 'chr3', ..., 'chrM'].
     """
     #good for human genome
-    file_in = open(file_path_in, "r")
-    save=False
-    readlines=True
-    while readlines:
-        try:
-            line = file_in.readline()
-        except:
-            print("Failed to read line. EOF? Exiting...")
-            readlines=False
-            break
-
-        if line[0] == ">":
-            if re.search("chromosome.*Primary.Assembly$", line) != None:
-                print(line)
-                linewords = line.split()
-                chromosome=linewords[4].strip(",")
-                if (chromosome=="1") | (chromosome=="2"):
-                    chromosome=f">chr0{chromosome}\n"
-                elif chromosome=="X":
-                    chromosome=f">chrX\n"
-                elif chromosome=="Y":
-                    chromosome=f">chrY\n"
-                else:
-                    chromosome=f">chr{chromosome}\n"
-                line=chromosome
-                print(line)
-                save=True
-            #fix for mitochondrial chr
-            elif re.search("mitochondrion, complete genome$", line) != None:
-                print(line)
-                line=f">chrM\n"
-                print(line)
-                save=True
-            else:
-                save=False
-
-        if save:
-            with open(file_path_out, "a") as file_out:
-                file_out.write(line)
\ No newline at end of file
+    return _createMMBSearchReference(file_path_in, file_path_out, fai=fai, split_dir=split_dir, block_size=block_size,
+                                     split_layout=split_layout, compress_split=compress_split, writer_threads=writer_threads)
\ No newline at end of file
@@ -2,25 +2,112 @@
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
 import os
+import sys
+import time
+import json
+import socket
+import threading
+import shutil
+import hashlib
 import argparse
 import logging
 import subprocess
 import multiprocessing
+from collections import deque
 from math import ceil
 import pandas as pd
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def splitDF(df: pd.DataFrame, slices_num: int, savecsv_path_root=None) -> list:
+# Slice formats and their file extensions. Feather (Arrow IPC) and Parquet preserve dtypes and require pyarrow.
+SLICE_FORMATS = ('csv', 'feather', 'parquet')
+
+def slicePath(slice_path_root: str, slice: int, slice_format: str = 'csv') -> str:
+    """
+    Returns the path to the file of a slice.
+
+    Args:
+        slice_path_root (str): The root path to the slice files.
+        slice (int): The slice number.
+        slice_format (str): Optional. The format of the slice files, one of SLICE_FORMATS. Default is 'csv'.
+
+    Returns:
+        str: The path to the slice file.
+    """
+    return f"{slice_path_root}_{slice}.{slice_format}"
+
+def writeSlice(df: pd.DataFrame, slice_path: str) -> None:
+    """
+    Saves a DataFrame slice to a file. The format is inferred from the file extension (.csv, .feather or .parquet).
+    Scripts run by paralleltools can use it together with readSlice to handle every slice format.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame slice to be saved.
+        slice_path (str): The path to the slice file.
+
+    Returns:
+        None
     """
-    Splits a pandas DataFrame into n=slices_num slices and saves each slice to a CSV file if a path is provided.
+    slice_format = os.path.splitext(slice_path)[1][1:]
+    if slice_format == 'feather':
+        # feather only stores a default index, slices of a larger df carry their original one
+        df.reset_index(drop=True).to_feather(slice_path)
+    elif slice_format == 'parquet':
+        df.to_parquet(slice_path, index=False)
+    elif slice_format == 'csv':
+        df.to_csv(slice_path, index=False)
+    else:
+        raise ValueError(f"Unsupported slice format: {slice_format}. Use one of {SLICE_FORMATS}.")
+
+def readSlice(slice_path: str) -> pd.DataFrame:
+    """
+    Reads a DataFrame slice from a file. The format is inferred from the file extension (.csv, .feather or .parquet).
+
+    Args:
+        slice_path (str): The path to the slice file.
+
+    Returns:
+        pandas.DataFrame: The DataFrame slice.
+    """
+    slice_format = os.path.splitext(slice_path)[1][1:]
+    if slice_format == 'feather':
+        return pd.read_feather(slice_path)
+    elif slice_format == 'parquet':
+        return pd.read_parquet(slice_path)
+    elif slice_format == 'csv':
+        return pd.read_csv(slice_path)
+    else:
+        raise ValueError(f"Unsupported slice format: {slice_format}. Use one of {SLICE_FORMATS}.")
+
+def makeScratchDir(results_df_name: str, scratch_dir: str = None) -> str:
+    """
+    Creates the per-run scratch directory that holds the slice files of a run.
+    The directory name depends only on the input name, so a resumed run finds the slices of the previous one.
+
+    Args:
+        results_df_name (str): The name of the input DataFrame.
+        scratch_dir (str): Optional. The directory in which the per-run directory is created, e.g. a tmpfs mount
+            such as /dev/shm. Default is the current working directory.
+
+    Returns:
+        str: The path to the per-run scratch directory.
+    """
+    run_dir = os.path.join(scratch_dir or '.', f'{results_df_name}_slices')
+    os.makedirs(run_dir, exist_ok=True)
+    return run_dir
+
+def splitDF(df: pd.DataFrame, slices_num: int, savecsv_path_root=None, save_slices: list = None, slice_format: str = 'csv') -> list:
+    """
+    Splits a pandas DataFrame into n=slices_num slices and saves each slice to a file if a path is provided.
     Returns a list of the DataFrame slices.
 
     Args:
         df (pandas.DataFrame): The DataFrame to be split.
         slices_num (int): The number of slices to create.
-        savecsv_path_root (str): Optional. The root path to save the CSV files. If not provided, the slices are not saved.
+        savecsv_path_root (str): Optional. The root path to save the slice files. If not provided, the slices are not saved.
+        save_slices (list): Optional. The numbers of the slices to be saved. If not provided, all slices are saved.
+        slice_format (str): Optional. The format of the slice files, one of SLICE_FORMATS. Default is 'csv'.
 
     Returns:
         list: A list of the DataFrame slices.
@@ -30,9 +117,9 @@ def splitDF(df: pd.DataFrame, slices_num: int, savecsv_path_root=None) -> list:
     for slice in range(slices_num):
         df_slice = df[slice*slice_size:(slice+1)*slice_size].copy()
         
-        if savecsv_path_root:
-            df_slice_name = f"{savecsv_path_root[0]}_{slice}.csv"
-            df_slice.to_csv(df_slice_name, index=False)
+        if savecsv_path_root and (save_slices is None or slice in save_slices):
+            df_slice_name = slicePath(savecsv_path_root, slice, slice_format)
+            writeSlice(df_slice, df_slice_name)
             logger.info(f'Slice {slice} saved to {df_slice_name}')
         
         slices_out.append(df_slice)
@@ -40,99 +127,1010 @@ def splitDF(df: pd.DataFrame, slices_num: int, savecsv_path_root=None) -> list:
     logger.info(f'Input df split into {slices_num} slices.')
     return slices_out
 
-def joinSlices(slices_num: int, slice_path_root: str, savecsv_path=None) -> pd.DataFrame:
+def joinSlices(slices_num: int, slice_path_root: str, savecsv_path=None, slice_format: str = 'csv') -> pd.DataFrame:
     """
     Combines the results from each slice into one pandas DataFrame and saves it to a CSV file if a path is provided.
     Returns the combined DataFrame.
 
     Args:
         slices_num (int): The number of slices to combine.
-        slice_path_root (str): The root path to the CSV files for each slice.
-        *savecsv_path (str): Optional. The path to save the combined DataFrame as a CSV file.
+        slice_path_root (str): The root path to the files for each slice.
+        savecsv_path (str): Optional. The path to save the combined DataFrame as a CSV file.
+        slice_format (str): Optional. The format of the slice files, one of SLICE_FORMATS. Default is 'csv'.
 
     Returns:
         pandas.DataFrame: The combined DataFrame.
     """
-    df = pd.DataFrame()
-    for slice in range(slices_num):
-        df_slice = pd.read_csv(f"{slice_path_root}_{slice}.csv")
-        df = pd.concat([df, df_slice], ignore_index=True)
+    # collect the slices first and concatenate once, concatenating inside the loop copies the growing df every time
+    df_slices = [readSlice(slicePath(slice_path_root, slice, slice_format)) for slice in range(slices_num)]
+    df = pd.concat(df_slices, ignore_index=True)
     
     if savecsv_path:
-        df.to_csv(savecsv_path[0], index=False)
-        logger.info(f'Slices joined! Results saved to {savecsv_path[0]}')
+        df.to_csv(savecsv_path, index=False)
+        logger.info(f'Slices joined! Results saved to {savecsv_path}')
     
     return df
 
-def cleanUpSlices(slices_num: int, slice_path_root: str) -> None:
+def cleanUpSlices(slices_num: int, slice_path_root: str, slice_format: str = 'csv') -> None:
     """
-    Deletes the CSV files for each slice of a DataFrame that was split using the `split_df` function.
+    Deletes the files for each slice of a DataFrame that was split using the `split_df` function.
 
     Args:
         slices_num (int): The number of slices that were created.
-        slice_path_root (str): The root path to the CSV files for each slice.
+        slice_path_root (str): The root path to the files for each slice.
+        slice_format (str): Optional. The format of the slice files, one of SLICE_FORMATS. Default is 'csv'.
 
     Returns:
         None
     """
     logger.info('Combining results from each slice...')
     for slice in range(slices_num):
-        os.remove(f"{slice_path_root}_{slice}.csv")
+        os.remove(slicePath(slice_path_root, slice, slice_format))
     logger.info(f'Clean up Finished! Deleted slice files.')
 
-def runScriptSubprocess(args: tuple[str, str]) -> None:
+def fileChecksum(file_path: str) -> str:
     """
-    Runs a Python script in a subprocess using the provided CSV file as input.
+    Calculates the SHA-256 checksum of a file, reading it in blocks.
 
     Args:
-        args (tuple): A tuple containing the path to the CSV file and the path to the Python script.
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest of the file.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def newManifest(results_df_path: str, script_path: str, mode: str, slices_num: int = None, chunksize: int = None, slice_format: str = 'csv') -> dict:
+    """
+    Creates a run manifest that records the status of each slice of a parallel run.
+
+    Args:
+        results_df_path (str): The path to the CSV file containing the input DataFrame.
+        script_path (str): The path to the Python script to be run.
+        mode (str): The mode of the run, 'pool' or 'stream'.
+        slices_num (int): Optional. The number of slices the input is split into. Unknown in streaming mode.
+        chunksize (int): Optional. The number of rows in each chunk in streaming mode.
+        slice_format (str): Optional. The format of the slice files, one of SLICE_FORMATS. Default is 'csv'.
+
+    Returns:
+        dict: The run manifest. The 'slices' entry maps slice numbers (as strings) to their status records.
+    """
+    input_stat = os.stat(results_df_path)
+    return {
+        'input': os.path.abspath(results_df_path),
+        'input_size': input_stat.st_size,
+        'input_mtime': input_stat.st_mtime,
+        'script': os.path.abspath(script_path),
+        'mode': mode,
+        'slices_num': slices_num,
+        'chunksize': chunksize,
+        'slice_format': slice_format,
+        'completed': False,
+        'slices': {}
+    }
+
+def loadManifest(manifest_path: str) -> dict:
+    """
+    Loads a run manifest from a JSON file.
+
+    Args:
+        manifest_path (str): The path to the manifest file.
+
+    Returns:
+        dict: The run manifest.
+    """
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def saveManifest(manifest: dict, manifest_path: str) -> None:
+    """
+    Saves a run manifest to a JSON file. The file is replaced atomically so an interrupted run never leaves a truncated manifest.
+
+    Args:
+        manifest (dict): The run manifest.
+        manifest_path (str): The path to the manifest file.
 
     Returns:
         None
     """
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+def resumeManifest(manifest_path: str, results_df_path: str, mode: str, chunksize: int = None, slice_format: str = 'csv') -> dict:
+    """
+    Loads the manifest of a previous run so it can be resumed. Returns None if there is no manifest,
+    or if it belongs to a different input, mode, chunk size or slice format, in which case the run has to start from scratch.
+
+    Args:
+        manifest_path (str): The path to the manifest file.
+        results_df_path (str): The path to the CSV file containing the input DataFrame.
+        mode (str): The mode of the run, 'pool' or 'stream'.
+        chunksize (int): Optional. The number of rows in each chunk in streaming mode.
+        slice_format (str): Optional. The format of the slice files, one of SLICE_FORMATS. Default is 'csv'.
+
+    Returns:
+        dict: The run manifest, or None if the previous run can't be resumed.
+    """
+    if not os.path.exists(manifest_path):
+        logger.warning(f'No manifest found at {manifest_path}. Starting a new run...')
+        return None
+
+    manifest = loadManifest(manifest_path)
+    input_stat = os.stat(results_df_path)
+    if (manifest['input_size'], manifest['input_mtime']) != (input_stat.st_size, input_stat.st_mtime):
+        logger.warning(f'{results_df_path} changed since the manifest was written. Starting a new run...')
+        return None
+    if (manifest['mode'], manifest['chunksize'], manifest['slice_format']) != (mode, chunksize, slice_format):
+        logger.warning(f'{manifest_path} was written by a {manifest["mode"]} run with chunksize={manifest["chunksize"]} '
+                       f'and slice_format={manifest["slice_format"]}. Starting a new run...')
+        return None
+
+    return manifest
+
+def isSliceDone(manifest: dict, slice: int, slice_path: str) -> bool:
+    """
+    Checks whether a slice finished successfully and its output on disk still matches the checksum recorded in the manifest.
+
+    Args:
+        manifest (dict): The run manifest.
+        slice (int): The slice number.
+        slice_path (str): The path to the slice output file.
+
+    Returns:
+        bool: True if the slice does not need to be run again, False otherwise.
+    """
+    record = manifest['slices'].get(str(slice))
+    if record is None or record['status'] != 'done':
+        return False
+    if not os.path.exists(slice_path) or fileChecksum(slice_path) != record['checksum']:
+        logger.warning(f'Output of slice {slice} is missing or does not match its checksum. It will be run again.')
+        return False
+    return True
+
+def iterCSVChunks(csv_path: str, chunksize: int):
+    """
+    Lazily reads a CSV file in chunks of n=chunksize rows, so that the whole file never has to fit in memory.
+
+    Args:
+        csv_path (str): The path to the CSV file to be read. The CSV file must contain a header row.
+        chunksize (int): The number of rows in each chunk.
+
+    Yields:
+        pandas.DataFrame: The consecutive chunks of the CSV file.
+    """
+    with pd.read_csv(csv_path, chunksize=chunksize) as reader:
+        for df_chunk in reader:
+            yield df_chunk
+
+class JointWriter:
+    """
+    Appends pandas DataFrames, in the order they are written, to a single CSV or Parquet file.
+    Only the DataFrame currently being written is held in memory.
+
+    Args:
+        path (str): The path to the output file.
+        output_format (str): Optional. Either 'csv' or 'parquet'. Default is 'csv'.
+            Writing Parquet requires the pyarrow package.
+    """
+
+    def __init__(self, path: str, output_format: str = 'csv') -> None:
+        if output_format not in ('csv', 'parquet'):
+            raise ValueError(f"Unsupported output format: {output_format}. Use 'csv' or 'parquet'.")
+        self.path = path
+        self.output_format = output_format
+        self.rows_written = 0
+        self._parquet_writer = None
+        self._parquet_schema = None
+        self._header_written = False
+
+    def write(self, df: pd.DataFrame) -> None:
+        """
+        Appends a DataFrame to the output file.
+
+        Args:
+            df (pandas.DataFrame): The DataFrame to be appended. Its columns must match the previously written ones.
+
+        Returns:
+            None
+        """
+        if self.output_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_schema = table.schema
+                self._parquet_writer = pq.ParquetWriter(self.path, self._parquet_schema)
+            else:
+                # slices re-read from CSV may infer different dtypes (e.g. all-NaN columns), align them to the first slice
+                table = table.cast(self._parquet_schema)
+            self._parquet_writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode='a' if self._header_written else 'w', header=not self._header_written, index=False)
+            self._header_written = True
+        self.rows_written += len(df)
+
+    def close(self) -> None:
+        """
+        Finalizes the output file.
+
+        Returns:
+            None
+        """
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def availableCPUs() -> int:
+    """
+    Finds the number of CPUs the current process may use, taking the CPU affinity mask and cgroup (v1 or v2)
+    CPU quotas into account, e.g. the limits of a Slurm job or a container.
+
+    Returns:
+        int: The number of usable CPUs.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    quota = period = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', 'r') as f:
+                quota = f.read().strip()
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us', 'r') as f:
+                period = f.read().strip()
+        except OSError:
+            pass
+    if quota not in (None, 'max', '-1'):
+        cpus = min(cpus, max(1, ceil(int(quota) / int(period))))
+
+    return cpus
+
+def availableMemory() -> int:
+    """
+    Finds the memory available to the current process in bytes: the smaller of MemAvailable in /proc/meminfo
+    and the remaining headroom of the cgroup (v1 or v2) memory limit.
+
+    Returns:
+        int: The available memory in bytes, or None if it can't be determined (e.g. outside Linux).
+    """
+    available = []
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available.append(int(line.split()[1]) * 1024)
+                    break
+    except OSError:
+        pass
+
+    for limit_path, usage_path in (('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+                                   ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        try:
+            with open(limit_path, 'r') as f:
+                limit = f.read().strip()
+            with open(usage_path, 'r') as f:
+                usage = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        # an unlimited cgroup reports 'max' (v2) or a huge page-rounded number (v1)
+        if limit != 'max' and int(limit) < 1 << 60:
+            available.append(max(0, int(limit) - usage))
+        break
+
+    return min(available) if available else None
+
+def recommendNumProcesses(chunk_memory: int = None) -> int:
+    """
+    Sizes the process pool from the usable CPUs and, if a per-chunk memory estimate is given, from the available memory,
+    so that workers are not OOM-killed on small nodes.
+
+    Args:
+        chunk_memory (int): Optional. The estimated peak memory of one worker processing one chunk, in bytes.
+
+    Returns:
+        int: The recommended number of processes.
+    """
+    cpus = availableCPUs()
+    num_processes = cpus
+    memory = availableMemory()
+    if chunk_memory and memory is not None:
+        num_processes = max(1, min(cpus, memory // chunk_memory))
+    logger.info(f'Using {num_processes} processes ({cpus} usable CPUs, '
+                f'{"unknown" if memory is None else f"{memory / 2**30:.1f} GiB"} available memory, '
+                f'{"no" if not chunk_memory else f"{chunk_memory / 2**20:.0f} MiB"} per-chunk memory estimate).')
+    return num_processes
+
+def buildRunReport(records: list, num_processes: int, wall_time: float = None) -> dict:
+    """
+    Summarizes the telemetry of the slices of a run per slice and per worker, for capacity planning.
+
+    Args:
+        records (list): The status records of the slices, as returned by runSliceWithRetries, with 'rows' added.
+        num_processes (int): The number of processes used.
+        wall_time (float): Optional. The wall time of the whole run in seconds.
+
+    Returns:
+        dict: The run report.
+    """
+    slices = []
+    workers = {}
+    for record in sorted(records, key=lambda record: record['slice']):
+        wall = record.get('wall_time')
+        rows = record.get('rows')
+        slices.append({
+            'slice': record['slice'],
+            'status': record['status'],
+            'worker': record.get('worker'),
+            'attempts': record.get('attempts'),
+            'rows': rows,
+            'wall_time': wall,
+            'cpu_time': record.get('cpu_time'),
+            'peak_rss': record.get('peak_rss'),
+            'rows_per_sec': rows / wall if rows is not None and wall else None
+        })
+        worker = workers.setdefault(record.get('worker'), {'slices': 0, 'rows': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'peak_rss': 0})
+        worker['slices'] += 1
+        worker['rows'] += rows or 0
+        worker['wall_time'] += wall or 0.0
+        worker['cpu_time'] += record.get('cpu_time') or 0.0
+        worker['peak_rss'] = max(worker['peak_rss'], record.get('peak_rss') or 0)
+
+    for worker in workers.values():
+        worker['rows_per_sec'] = worker['rows'] / worker['wall_time'] if worker['wall_time'] else None
+
+    return {
+        'host': socket.gethostname(),
+        'usable_cpus': availableCPUs(),
+        'available_memory': availableMemory(),
+        'num_processes': num_processes,
+        'wall_time': wall_time,
+        'rows': sum(slice['rows'] or 0 for slice in slices),
+        'cpu_time': sum(slice['cpu_time'] or 0.0 for slice in slices),
+        'peak_rss': max((slice['peak_rss'] or 0 for slice in slices), default=0),
+        'workers': workers,
+        'slices': slices
+    }
+
+def saveRunReport(report: dict, report_path: str) -> None:
+    """
+    Saves a run report to a JSON file.
+
+    Args:
+        report (dict): The run report, as returned by buildRunReport.
+        report_path (str): The path to the report file.
+
+    Returns:
+        None
+    """
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'Run report saved to {report_path}')
+
+def runScriptSubprocess(args: tuple[str, str]) -> int:
+    """
+    Runs a Python script in a subprocess using the provided slice file as input.
+
+    Args:
+        args (tuple): A tuple containing the path to the slice file and the path to the Python script.
+
+    Returns:
+        int: The return code of the subprocess.
+    """
+    return runScriptMeasured(args)['returncode']
+
+def runScriptMeasured(args: tuple[str, str]) -> dict:
+    """
+    Runs a Python script in a subprocess using the provided slice file as input, and measures its resource use.
+
+    Args:
+        args (tuple): A tuple containing the path to the slice file and the path to the Python script.
+
+    Returns:
+        dict: A dictionary with the keys 'returncode', 'wall_time' and 'cpu_time' (in seconds) and 'peak_rss' (in bytes).
+            CPU time and peak RSS are None on platforms without os.wait4 (e.g. Windows).
+    """
     csv_slice, script_path = args
-    subprocess.call(['python', script_path, csv_slice])
+    start = time.perf_counter()
+    process = subprocess.Popen(['python', script_path, csv_slice])
+    usage = {'returncode': None, 'wall_time': None, 'cpu_time': None, 'peak_rss': None}
+    if hasattr(os, 'wait4'):
+        # wait4 reports the resource use of this child alone, unlike getrusage(RUSAGE_CHILDREN)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        usage['cpu_time'] = rusage.ru_utime + rusage.ru_stime
+        usage['peak_rss'] = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+    else:
+        process.wait()
+    usage['returncode'] = process.returncode
+    usage['wall_time'] = time.perf_counter() - start
+    return usage
+
+def runSliceWithRetries(args: tuple[int, str, str, int]) -> dict:
+    """
+    Runs a Python script on a slice, retrying up to n=max_retries times if the script fails.
+    The script is expected to overwrite the slice file with its results, so an untouched copy of the slice
+    is kept next to it and restored before each retry. The copy is kept if all attempts fail.
+
+    Args:
+        args (tuple): A tuple containing the slice number, the path to the slice file, the path to the Python script
+            and the maximum number of retries.
+
+    Returns:
+        dict: The status record of the slice, with the keys 'slice', 'status' ('done' or 'failed'), 'returncode',
+            'attempts', 'checksum' (of the slice output, None if the slice failed), 'worker' (the process that ran it)
+            and the telemetry of all attempts: 'wall_time', 'cpu_time' (in seconds) and 'peak_rss' (in bytes).
+    """
+    slice, slice_path, script_path, max_retries = args
+    pristine_path = f'{slice_path}.orig'
+    shutil.copyfile(slice_path, pristine_path)
+    wall_time, cpu_time, peak_rss = 0.0, None, None
+
+    for attempt in range(1, max_retries + 2):
+        if attempt > 1:
+            logger.warning(f'Slice {slice} failed with return code {returncode}. Retrying ({attempt-1}/{max_retries})...')
+            shutil.copyfile(pristine_path, slice_path)
+        usage = runScriptMeasured((slice_path, script_path))
+        returncode = usage['returncode']
+        wall_time += usage['wall_time']
+        if usage['cpu_time'] is not None:
+            cpu_time = (cpu_time or 0.0) + usage['cpu_time']
+            peak_rss = max(peak_rss or 0, usage['peak_rss'])
+        if returncode == 0 and not os.path.exists(slice_path):
+            logger.warning(f'{script_path} exited cleanly but {slice_path} is missing.')
+            returncode = None
+        if returncode == 0:
+            break
+
+    record = {'slice': slice, 'status': 'failed', 'returncode': returncode, 'attempts': attempt, 'checksum': None,
+              'worker': _workerId(), 'wall_time': wall_time, 'cpu_time': cpu_time, 'peak_rss': peak_rss}
+    if returncode == 0:
+        os.remove(pristine_path)
+        record['status'] = 'done'
+        record['checksum'] = fileChecksum(slice_path)
+    else:
+        logger.error(f'Slice {slice} failed after {attempt} attempts. Its input was kept in {pristine_path}.')
+    return record
 
-def runMainPool(script_path: str, results_df_path: str, num_processes: int = 8, joint_name: str = 'all') -> None:
+def runMainPool(script_path: str, results_df_path: str, num_processes: int = None, joint_name: str = 'all', max_retries: int = 2, resume: bool = False, slice_format: str = 'csv', scratch_dir: str = None, chunk_memory: int = None) -> None:
     """
     Runs a Python script in parallel on a pandas DataFrame using the provided CSV file as input.
+    The status and output checksum of each slice are recorded in a run manifest ({name}_manifest.json).
+    If any slice fails after all retries, the slice files and the manifest are kept and a RuntimeError is raised.
+    Running again with resume=True re-runs only the failed or missing slices.
+    Slice files are kept in a per-run scratch directory ({name}_slices) inside scratch_dir. The script receives
+    the path to a slice file and must overwrite it in the same format (see readSlice and writeSlice).
+    Per-slice and per-worker wall time, CPU time, peak RSS and rows/sec are saved to {name}_run_report.json.
 
     Args:
         script_path (str): The path to the Python script to be run.
         results_df_path (str): The path to the CSV file containing the input DataFrame.
-        num_processes (int): Optional. The number of processes to use for parallelization. Default is 8.
+        num_processes (int): Optional. The number of processes (and slices) to use for parallelization.
+            Default is sized from the usable CPUs and memory with recommendNumProcesses.
         joint_name (str): Optional. The name of the output CSV file containing the combined results. Default is 'all'.
+        max_retries (int): Optional. The number of times a failed slice is retried. Default is 2.
+        resume (bool): Optional. Whether to resume the run recorded in the manifest. Default is False.
+        slice_format (str): Optional. The format of the slice files, one of SLICE_FORMATS. Default is 'csv'.
+        scratch_dir (str): Optional. The directory for the per-run scratch directory, e.g. /dev/shm. Default is the working directory.
+        chunk_memory (int): Optional. The estimated peak memory of one worker processing one slice, in bytes.
+            Used to size the pool when num_processes is not provided.
 
     Returns:
         None
+
+    Raises:
+        RuntimeError: If any slice failed after all retries.
     """
-    with open(results_df_path, 'r') as f:
-        df = pd.read_csv(f)
-        results_df_name = os.path.basename(results_df_path)[:-4]
+    start = time.perf_counter()
+    if num_processes is None:
+        num_processes = recommendNumProcesses(chunk_memory)
+    results_df_name = os.path.basename(results_df_path)[:-4]
+    manifest_path = f'{results_df_name}_manifest.json'
+    report_path = f'{results_df_name}_run_report.json'
+    run_dir = makeScratchDir(results_df_name, scratch_dir)
+    slice_path_root = os.path.join(run_dir, results_df_name)
+
+    manifest = resumeManifest(manifest_path, results_df_path, 'pool', slice_format=slice_format) if resume else None
+    if manifest is None:
+        manifest = newManifest(results_df_path, script_path, 'pool', slices_num=num_processes, slice_format=slice_format)
+    elif manifest['completed']:
+        logger.info(f'{manifest_path} records a completed run. Nothing to resume.')
+        return
+    slices_num = manifest['slices_num']
+
+    slices_to_run = [slice for slice in range(slices_num) if not isSliceDone(manifest, slice, slicePath(slice_path_root, slice, slice_format))]
+    if slices_to_run:
+        # split the df into n=slices_num slices and save the slices that have to be (re)run to slice files
+        logger.info(f'Splitting {results_df_name} into {slices_num} slices...')
+        with open(results_df_path, 'r') as f:
+            df = pd.read_csv(f)
+        slice_rows = [len(df_slice) for df_slice in splitDF(df, slices_num, slice_path_root, save_slices=slices_to_run, slice_format=slice_format)]
+        del df
+        for slice in slices_to_run:
+            manifest['slices'][str(slice)] = {'slice': slice, 'status': 'pending', 'returncode': None, 'attempts': 0, 'checksum': None, 'rows': slice_rows[slice]}
+        saveManifest(manifest, manifest_path)
 
-        # split the df into n=num_processes slices and save each slice to a csv file
-        logger.info(f'Splitting {results_df_name} into {num_processes} slices...')
-        splitDF(df, num_processes, results_df_name)
+        # run the script in parallel on each slice, recording each slice in the manifest as soon as it finishes
+        logger.info(f'Running {script_path} in parallel on {len(slices_to_run)} slices...')
+        with multiprocessing.Pool(processes=min(num_processes, len(slices_to_run))) as pool:
+            tasks = [(slice, slicePath(slice_path_root, slice, slice_format), script_path, max_retries) for slice in slices_to_run]
+            for record in pool.imap_unordered(runSliceWithRetries, tasks):
+                record['rows'] = slice_rows[record['slice']]
+                manifest['slices'][str(record['slice'])] = record
+                saveManifest(manifest, manifest_path)
+        logger.info(f'Finished {len(slices_to_run)} processes...')
+    else:
+        logger.info(f'All {slices_num} slices are already done.')
+    saveRunReport(buildRunReport(list(manifest['slices'].values()), num_processes, time.perf_counter() - start), report_path)
 
-        # run the script in parallel on each slice
-        logger.info(f'Running {script_path} in parallel on {num_processes} slices...')
-        pool = multiprocessing.Pool(processes=num_processes)
-        pool.map(runScriptSubprocess, [(f"{results_df_name}_{slice}.csv", script_path) for slice in range(num_processes)])
-        pool.close()
-        pool.join()
-        logger.info(f'Finished {num_processes} processes...')
+    failed_slices = sorted(int(slice) for slice, record in manifest['slices'].items() if record['status'] != 'done')
+    if failed_slices:
+        raise RuntimeError(f'Slices {failed_slices} of {results_df_name} failed. Slice files in {run_dir} and {manifest_path} were kept, '
+                           f'run again with --resume to re-run only the failed slices.')
 
-        # join the results from each slice into one DataFrame and save it to a CSV file
-        joint_path = f'{results_df_name}_{joint_name}.csv'
-        logger.info(f'Joining results from {num_processes} slices into {joint_path}...')
-        joinSlices(num_processes, results_df_name, joint_path)
+    # join the results from each slice into one DataFrame and save it to a CSV file
+    joint_path = f'{results_df_name}_{joint_name}.csv'
+    logger.info(f'Joining results from {slices_num} slices into {joint_path}...')
+    joinSlices(slices_num, slice_path_root, joint_path, slice_format=slice_format)
 
-        # clean up the slice files
-        logger.info(f'Cleaning up slice files for {results_df_name}...')
-        cleanUpSlices(num_processes, results_df_name)
+    # clean up the slice files
+    logger.info(f'Cleaning up slice files for {results_df_name}...')
+    cleanUpSlices(slices_num, slice_path_root, slice_format=slice_format)
+    if not os.listdir(run_dir):
+        os.rmdir(run_dir)
+    manifest['completed'] = True
+    saveManifest(manifest, manifest_path)
 
     logger.info(f'Finished processing {results_df_name}.')
 
+def _appendFinishedSlice(pending: deque, writer: JointWriter, manifest: dict, manifest_path: str) -> bool:
+    """
+    Waits for the oldest dispatched slice to finish, records it in the manifest and appends its results to the joint output.
+
+    Args:
+        pending (collections.deque): The queue of (slice number, slice path, AsyncResult) tuples in dispatch order.
+            The AsyncResult is None for slices that were already done in a resumed run.
+        writer (JointWriter): The writer of the joint output, or None if the joint output is no longer written
+            because an earlier slice failed.
+        manifest (dict): The run manifest.
+        manifest_path (str): The path to the manifest file.
+
+    Returns:
+        bool: True if the slice is done, False if it failed.
+    """
+    slice, slice_path, async_result = pending.popleft()
+    if async_result is not None:
+        record = async_result.get()
+        record['rows'] = manifest['slices'][str(slice)]['rows']
+        manifest['slices'][str(slice)] = record
+        saveManifest(manifest, manifest_path)
+
+    if manifest['slices'][str(slice)]['status'] != 'done':
+        return False
+    if writer is not None:
+        writer.write(readSlice(slice_path))
+        logger.info(f'Slice {slice} appended to {writer.path}')
+    return True
+
+def runStreamingPool(script_path: str, results_df_path: str, num_processes: int = None, chunksize: int = 100000, joint_name: str = 'all', output_format: str = 'csv', max_pending: int = None, max_retries: int = 2, resume: bool = False, slice_format: str = 'csv', scratch_dir: str = None, chunk_memory: int = None) -> None:
+    """
+    Runs a Python script in parallel on a CSV file that is too large to be loaded into memory at once.
+    The input is read in chunks of n=chunksize rows and each chunk is dispatched to a worker as soon as it is read.
+    Results are appended to a single output file in input order. At most n=max_pending chunks are in flight at a time,
+    so peak memory stays at a few chunks regardless of the input size.
+    As in runMainPool, each chunk is recorded in a run manifest. Chunk outputs are kept until the whole run succeeds,
+    so a failed run can be resumed with resume=True, which re-runs only the failed or missing chunks.
+    Per-chunk and per-worker telemetry is saved to {name}_run_report.json.
+
+    Args:
+        script_path (str): The path to the Python script to be run.
+        results_df_path (str): The path to the CSV file containing the input DataFrame.
+        num_processes (int): Optional. The number of processes to use for parallelization.
+            Default is sized from the usable CPUs and memory with recommendNumProcesses.
+        chunksize (int): Optional. The number of rows in each chunk. Default is 100000.
+        joint_name (str): Optional. The name of the output file containing the combined results. Default is 'all'.
+        output_format (str): Optional. The format of the output file, 'csv' or 'parquet'. Default is 'csv'.
+        max_pending (int): Optional. The maximum number of chunks in flight. Default is 2*num_processes.
+        max_retries (int): Optional. The number of times a failed chunk is retried. Default is 2.
+        resume (bool): Optional. Whether to resume the run recorded in the manifest. Default is False.
+        slice_format (str): Optional. The format of the chunk files, one of SLICE_FORMATS. Default is 'csv'.
+        scratch_dir (str): Optional. The directory for the per-run scratch directory, e.g. /dev/shm. Default is the working directory.
+        chunk_memory (int): Optional. The estimated peak memory of one worker processing one chunk, in bytes.
+            Used to size the pool when num_processes is not provided.
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: If any chunk failed after all retries.
+    """
+    start = time.perf_counter()
+    if num_processes is None:
+        num_processes = recommendNumProcesses(chunk_memory)
+    results_df_name = os.path.basename(results_df_path)[:-4]
+    joint_path = f'{results_df_name}_{joint_name}.{output_format}'
+    manifest_path = f'{results_df_name}_manifest.json'
+    report_path = f'{results_df_name}_run_report.json'
+    run_dir = makeScratchDir(results_df_name, scratch_dir)
+    slice_path_root = os.path.join(run_dir, results_df_name)
+    if max_pending is None:
+        max_pending = 2 * num_processes
+
+    manifest = resumeManifest(manifest_path, results_df_path, 'stream', chunksize=chunksize, slice_format=slice_format) if resume else None
+    if manifest is None:
+        manifest = newManifest(results_df_path, script_path, 'stream', chunksize=chunksize, slice_format=slice_format)
+    elif manifest['completed']:
+        logger.info(f'{manifest_path} records a completed run. Nothing to resume.')
+        return
+
+    logger.info(f'Streaming {results_df_name} in chunks of {chunksize} rows to {num_processes} processes...')
+    pending = deque()
+    joint_ok = True
+    with multiprocessing.Pool(processes=num_processes) as pool, JointWriter(joint_path, output_format) as writer:
+        for slice, df_chunk in enumerate(iterCSVChunks(results_df_path, chunksize)):
+            slice_path = slicePath(slice_path_root, slice, slice_format)
+            if isSliceDone(manifest, slice, slice_path):
+                pending.append((slice, slice_path, None))
+            else:
+                writeSlice(df_chunk, slice_path)
+                manifest['slices'][str(slice)] = {'slice': slice, 'status': 'pending', 'returncode': None, 'attempts': 0, 'checksum': None, 'rows': len(df_chunk)}
+                pending.append((slice, slice_path, pool.apply_async(runSliceWithRetries, ((slice, slice_path, script_path, max_retries),))))
+            del df_chunk
+
+            # block on the oldest chunk when too many are in flight, this bounds memory use
+            while len(pending) >= max_pending:
+                joint_ok = _appendFinishedSlice(pending, writer if joint_ok else None, manifest, manifest_path) and joint_ok
+
+        while pending:
+            joint_ok = _appendFinishedSlice(pending, writer if joint_ok else None, manifest, manifest_path) and joint_ok
+
+    slices_num = len(manifest['slices'])
+    manifest['slices_num'] = slices_num
+    saveManifest(manifest, manifest_path)
+    saveRunReport(buildRunReport(list(manifest['slices'].values()), num_processes, time.perf_counter() - start), report_path)
+
+    failed_slices = sorted(int(slice) for slice, record in manifest['slices'].items() if record['status'] != 'done')
+    if failed_slices:
+        if os.path.exists(joint_path):
+            os.remove(joint_path)
+        raise RuntimeError(f'Chunks {failed_slices} of {results_df_name} failed. Chunk files in {run_dir} and {manifest_path} were kept, '
+                           f'run again with --resume to re-run only the failed chunks.')
+
+    cleanUpSlices(slices_num, slice_path_root, slice_format=slice_format)
+    if not os.listdir(run_dir):
+        os.rmdir(run_dir)
+    manifest['completed'] = True
+    saveManifest(manifest, manifest_path)
+
+    logger.info(f'Finished processing {results_df_name}. {writer.rows_written} rows saved to {joint_path}.')
+
+def _workerId() -> str:
+    """
+    Returns an identifier of the current process that is unique across the nodes sharing a run directory.
+
+    Returns:
+        str: The identifier, in the form hostname.pid.
+    """
+    return f'{socket.gethostname()}.{os.getpid()}'
+
+def _queueFilePath(run_dir: str, slice: int, suffix: str) -> str:
+    """
+    Returns the path to a queue bookkeeping file of a slice, e.g. its claim or its done/failed marker.
+
+    Args:
+        run_dir (str): The shared run directory.
+        slice (int): The slice number.
+        suffix (str): The kind of the file: 'claim', 'done' or 'failed'.
+
+    Returns:
+        str: The path to the file.
+    """
+    return os.path.join(run_dir, f'slice_{slice}.{suffix}')
+
+def claimSlice(run_dir: str, slice: int, claim_timeout: float = None) -> bool:
+    """
+    Atomically claims a slice of a shared run directory for the current process.
+    The claim file is created with a hard link, which is atomic on NFS as well (unlike O_EXCL on older NFS versions).
+    Claims whose file was not touched for more than claim_timeout seconds are considered abandoned and are taken over.
+
+    Args:
+        run_dir (str): The shared run directory.
+        slice (int): The slice number.
+        claim_timeout (float): Optional. The age in seconds after which a claim is abandoned. If not provided,
+            claims never expire. It should be much longer than the heartbeat interval and the clock skew between nodes.
+
+    Returns:
+        bool: True if the slice was claimed by the current process, False if it is claimed by another one.
+    """
+    claim_path = _queueFilePath(run_dir, slice, 'claim')
+    worker_id = _workerId()
+
+    if claim_timeout is not None:
+        stale_path = f'{claim_path}.stale.{worker_id}'
+        try:
+            if time.time() - os.stat(claim_path).st_mtime > claim_timeout:
+                os.rename(claim_path, stale_path)
+                # another worker may have replaced the stale claim with a fresh one in the meantime, give it back
+                if time.time() - os.stat(stale_path).st_mtime <= claim_timeout:
+                    try:
+                        os.link(stale_path, claim_path)
+                    except FileExistsError:
+                        pass
+                    finally:
+                        os.remove(stale_path)
+                    return False
+                logger.warning(f'Claim on slice {slice} expired. Taking it over...')
+                os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+    tmp_path = f'{claim_path}.{worker_id}'
+    with open(tmp_path, 'w') as f:
+        f.write(worker_id)
+    try:
+        os.link(tmp_path, claim_path)
+        claimed = True
+    except FileExistsError:
+        claimed = False
+    except OSError:
+        # the link may have succeeded on the server even if the reply was lost, the link count tells
+        claimed = os.stat(tmp_path).st_nlink == 2
+    finally:
+        os.remove(tmp_path)
+    return claimed
+
+def releaseSlice(run_dir: str, slice: int) -> None:
+    """
+    Releases the claim of the current process on a slice.
+
+    Args:
+        run_dir (str): The shared run directory.
+        slice (int): The slice number.
+
+    Returns:
+        None
+    """
+    try:
+        os.remove(_queueFilePath(run_dir, slice, 'claim'))
+    except FileNotFoundError:
+        pass
+
+def _heartbeat(claim_path: str, interval: float, stop_event: threading.Event) -> None:
+    """
+    Touches a claim file every n=interval seconds until stop_event is set, so the claim does not expire.
+
+    Args:
+        claim_path (str): The path to the claim file.
+        interval (float): The number of seconds between touches.
+        stop_event (threading.Event): The event that stops the heartbeat.
+
+    Returns:
+        None
+    """
+    while not stop_event.wait(interval):
+        try:
+            os.utime(claim_path)
+        except FileNotFoundError:
+            return
+
+def queueStatus(run_dir: str) -> dict:
+    """
+    Reads the status of every slice of a shared run directory from its bookkeeping files.
+
+    Args:
+        run_dir (str): The shared run directory.
+
+    Returns:
+        dict: A dictionary mapping slice numbers to 'done', 'failed', 'claimed' or 'pending'.
+    """
+    manifest = loadManifest(os.path.join(run_dir, 'manifest.json'))
+    status = {}
+    for slice in range(manifest['slices_num']):
+        for state, suffix in (('done', 'done'), ('failed', 'failed'), ('claimed', 'claim')):
+            if os.path.exists(_queueFilePath(run_dir, slice, suffix)):
+                status[slice] = state
+                break
+        else:
+            status[slice] = 'pending'
+    return status
+
+def initQueue(script_path: str, results_df_path: str, slices_num: int = None, chunksize: int = None, slice_format: str = 'csv', scratch_dir: str = None) -> str:
+    """
+    Splits the input into slices inside a run directory ({name}_slices in scratch_dir) that workers on any node
+    sharing the filesystem can take slices from with runQueueWorker. Does nothing if the run directory is already initialized.
+
+    Args:
+        script_path (str): The path to the Python script to be run. It must be reachable at the same path from every node.
+        results_df_path (str): The path to the CSV file containing the input DataFrame.
+        slices_num (int): Optional. The number of slices to create. Default is sized with recommendNumProcesses.
+        chunksize (int): Optional. If provided, the input is streamed into slices of this many rows instead
+            of being loaded whole and split into n=slices_num slices.
+        slice_format (str): Optional. The format of the slice files, one of SLICE_FORMATS. Default is 'csv'.
+        scratch_dir (str): Optional. The shared directory in which the run directory is created. Default is the working directory.
+
+    Returns:
+        str: The path to the run directory.
+    """
+    results_df_name = os.path.basename(results_df_path)[:-4]
+    run_dir = makeScratchDir(results_df_name, scratch_dir)
+    manifest_path = os.path.join(run_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        logger.info(f'{run_dir} is already initialized.')
+        return run_dir
+
+    slice_path_root = os.path.join(run_dir, results_df_name)
+    if chunksize:
+        slice_rows = []
+        for slice, df_chunk in enumerate(iterCSVChunks(results_df_path, chunksize)):
+            writeSlice(df_chunk, slicePath(slice_path_root, slice, slice_format))
+            slice_rows.append(len(df_chunk))
+        slices_num = len(slice_rows)
+    else:
+        if slices_num is None:
+            slices_num = recommendNumProcesses()
+        slice_rows = [len(df_slice) for df_slice in splitDF(pd.read_csv(results_df_path), slices_num, slice_path_root, slice_format=slice_format)]
+
+    # the manifest is written last, workers only start on a fully initialized run directory
+    manifest = newManifest(results_df_path, script_path, 'queue', slices_num=slices_num, chunksize=chunksize, slice_format=slice_format)
+    manifest['name'] = results_df_name
+    manifest['slice_rows'] = slice_rows
+    saveManifest(manifest, manifest_path)
+    logger.info(f'Initialized {run_dir} with {slices_num} slices.')
+    return run_dir
+
+def runQueueWorker(run_dir: str, script_path: str = None, max_retries: int = 2, claim_timeout: float = None, retry_failed: bool = False) -> int:
+    """
+    Processes slices of a shared run directory until none is left to claim. Any number of workers, on any node
+    sharing the filesystem, can work on the same run directory at the same time. Each finished slice is marked
+    with a slice_N.done (or slice_N.failed) file holding its status record.
+
+    Args:
+        run_dir (str): The shared run directory created by initQueue.
+        script_path (str): Optional. The path to the Python script to be run. Default is the script recorded by initQueue.
+        max_retries (int): Optional. The number of times a failed slice is retried. Default is 2.
+        claim_timeout (float): Optional. The age in seconds after which claims of dead workers are taken over.
+            While a slice is processed its claim is refreshed every claim_timeout/4 seconds. If not provided, claims never expire.
+        retry_failed (bool): Optional. Whether to process slices that failed in an earlier attempt. Default is False.
+
+    Returns:
+        int: The number of slices processed by this worker.
+    """
+    manifest = loadManifest(os.path.join(run_dir, 'manifest.json'))
+    script_path = script_path or manifest['script']
+    slice_path_root = os.path.join(run_dir, manifest['name'])
+    attempted = set()
+    # slices found done by another worker right after claiming them, neither run nor counted
+    skipped = set()
+
+    while True:
+        claimed_any = False
+        for slice in range(manifest['slices_num']):
+            if slice in attempted or slice in skipped or os.path.exists(_queueFilePath(run_dir, slice, 'done')):
+                continue
+            if not retry_failed and os.path.exists(_queueFilePath(run_dir, slice, 'failed')):
+                continue
+            if not claimSlice(run_dir, slice, claim_timeout):
+                continue
+            claimed_any = True
+
+            # another worker may have finished the slice between the check above and the claim
+            if os.path.exists(_queueFilePath(run_dir, slice, 'done')):
+                skipped.add(slice)
+                releaseSlice(run_dir, slice)
+                continue
+            attempted.add(slice)
+
+            stop_event = threading.Event()
+            if claim_timeout is not None:
+                threading.Thread(target=_heartbeat, args=(_queueFilePath(run_dir, slice, 'claim'), claim_timeout / 4, stop_event), daemon=True).start()
+            try:
+                slice_path = slicePath(slice_path_root, slice, manifest['slice_format'])
+                # a previous attempt may have died halfway through overwriting the slice, start from its untouched copy
+                if os.path.exists(f'{slice_path}.orig'):
+                    shutil.copyfile(f'{slice_path}.orig', slice_path)
+                logger.info(f'Worker {_workerId()} processing slice {slice}...')
+                record = runSliceWithRetries((slice, slice_path, script_path, max_retries))
+                record['rows'] = manifest['slice_rows'][slice]
+
+                marker_path = _queueFilePath(run_dir, slice, record['status'])
+                with open(f'{marker_path}.{_workerId()}', 'w') as f:
+                    json.dump(record, f)
+                os.replace(f'{marker_path}.{_workerId()}', marker_path)
+                if record['status'] == 'done' and os.path.exists(_queueFilePath(run_dir, slice, 'failed')):
+                    os.remove(_queueFilePath(run_dir, slice, 'failed'))
+            finally:
+                stop_event.set()
+                releaseSlice(run_dir, slice)
+
+        if not claimed_any:
+            break
+
+    logger.info(f'Worker {_workerId()} finished after processing {len(attempted)} slices.')
+    return len(attempted)
+
+def runQueueWorkers(run_dir: str, num_processes: int = None, script_path: str = None, max_retries: int = 2, claim_timeout: float = None, retry_failed: bool = False, chunk_memory: int = None) -> int:
+    """
+    Starts n=num_processes queue workers on the current node, each running runQueueWorker on the same run directory.
+
+    Args:
+        run_dir (str): The shared run directory created by initQueue.
+        num_processes (int): Optional. The number of worker processes to start. Default is sized from the usable CPUs
+            and memory of this node with recommendNumProcesses.
+        script_path (str): Optional. The path to the Python script to be run. Default is the script recorded by initQueue.
+        max_retries (int): Optional. The number of times a failed slice is retried. Default is 2.
+        claim_timeout (float): Optional. The age in seconds after which claims of dead workers are taken over.
+        retry_failed (bool): Optional. Whether to process slices that failed in an earlier attempt. Default is False.
+        chunk_memory (int): Optional. The estimated peak memory of one worker processing one slice, in bytes.
+
+    Returns:
+        int: The number of slices processed on this node.
+    """
+    if num_processes is None:
+        num_processes = recommendNumProcesses(chunk_memory)
+    with multiprocessing.Pool(processes=num_processes) as pool:
+        processed = pool.starmap(runQueueWorker, [(run_dir, script_path, max_retries, claim_timeout, retry_failed)] * num_processes)
+    return sum(processed)
+
+def joinQueue(run_dir: str, joint_path: str, cleanup: bool = True) -> pd.DataFrame:
+    """
+    Joins the results of all slices of a shared run directory into one DataFrame and saves it to a CSV file.
+    The outputs are verified against the checksums recorded by the workers before they are joined, and the telemetry
+    recorded by all workers is saved to a run report ({name}_run_report.json, next to joint_path).
+
+    Args:
+        run_dir (str): The shared run directory created by initQueue.
+        joint_path (str): The path to save the combined DataFrame as a CSV file.
+        cleanup (bool): Optional. Whether to delete the run directory after joining. Default is True.
+
+    Returns:
+        pandas.DataFrame: The combined DataFrame.
+
+    Raises:
+        RuntimeError: If any slice is not done, or its output does not match its checksum.
+    """
+    manifest = loadManifest(os.path.join(run_dir, 'manifest.json'))
+    slice_path_root = os.path.join(run_dir, manifest['name'])
+
+    status = queueStatus(run_dir)
+    not_done = {slice: state for slice, state in status.items() if state != 'done'}
+    if not_done:
+        raise RuntimeError(f'Not all slices in {run_dir} are done: {not_done}. Start more workers, or workers with --resume to retry failed slices.')
+
+    records = []
+    for slice in status:
+        with open(_queueFilePath(run_dir, slice, 'done'), 'r') as f:
+            record = json.load(f)
+        records.append(record)
+        if fileChecksum(slicePath(slice_path_root, slice, manifest['slice_format'])) != record['checksum']:
+            raise RuntimeError(f'Output of slice {slice} in {run_dir} does not match the checksum recorded by worker {record["worker"]}.')
+
+    logger.info(f'Joining results from {manifest["slices_num"]} slices into {joint_path}...')
+    df = joinSlices(manifest['slices_num'], slice_path_root, joint_path, slice_format=manifest['slice_format'])
+    report = buildRunReport(records, len({record['worker'] for record in records}))
+    saveRunReport(report, os.path.join(os.path.dirname(joint_path), f'{manifest["name"]}_run_report.json'))
+
+    if cleanup:
+        shutil.rmtree(run_dir)
+        logger.info(f'Clean up Finished! Deleted {run_dir}.')
+    return df
+
 def parseArguments() -> argparse.Namespace:
     """
     Parses command line arguments.
@@ -143,9 +1141,13 @@ def parseArguments() -> argparse.Namespace:
     program_description =  'This program runs a Python script in parallel on a pandas DataFrame using \
                             the provided CSV file as input. The CSV file must contain a header row. \
                             Caution: The CSV file will be split into n=num_processes slices and each slice \
-                            will be saved to a CSV file. The slice files will be deleted after the script \
-                            is finished. Make sure that your input file can be divided into sub-files \
-                            without losing data...'
+                            will be saved to a slice file (CSV, Feather or Parquet, see --slice_format). \
+                            The script is called with the path to a slice and must overwrite it in the same format. \
+                            The slice files will be deleted after the script is finished. Make sure that your \
+                            input file can be divided into sub-files without losing data... \
+                            With --queue, the run is spread over several nodes sharing a filesystem: \
+                            "init" splits the input into --scratch_dir, "work" starts workers (on any node) \
+                            that claim slices until none is left, and "join" assembles the results.'
     
     parser = argparse.ArgumentParser(description=program_description)
 
@@ -153,7 +1155,16 @@ def parseArguments() -> argparse.Namespace:
         '-v': {'name': '--version', 'action': 'version', 'version': '%(prog)s 1.0'},
         '-t': {'name': '--target', 'type': str, 'default': 'myscript.py', 'help': 'Path to the Python script to be run'},
         '-r': {'name': '--results_df_path', 'type': str, 'default': 'results_df.csv', 'help': 'Path to the results dataframe to be processed'},
-        '-p': {'name': '--num_processes', 'type': int, 'default': 8, 'help': 'Number of processes (cores) to use'}
+        '-p': {'name': '--num_processes', 'type': int, 'default': None, 'help': 'Number of processes (cores) to use, sized from the usable CPUs and memory by default'},
+        '-M': {'name': '--chunk_memory', 'type': float, 'default': None, 'help': 'Estimated peak memory of one worker on one slice in MB, limits the default number of processes'},
+        '-c': {'name': '--chunksize', 'type': int, 'default': None, 'help': 'Stream the input in chunks of this many rows instead of loading it whole (streaming mode)'},
+        '-f': {'name': '--output_format', 'type': str, 'default': 'csv', 'choices': ['csv', 'parquet'], 'help': 'Format of the joint output in streaming mode'},
+        '-n': {'name': '--max_retries', 'type': int, 'default': 2, 'help': 'Number of times a failed slice is retried'},
+        '-R': {'name': '--resume', 'action': 'store_true', 'help': 'Resume the run recorded in the manifest, re-running only failed or missing slices'},
+        '-s': {'name': '--slice_format', 'type': str, 'default': 'csv', 'choices': list(SLICE_FORMATS), 'help': 'Format of the intermediate slice files, feather and parquet preserve dtypes'},
+        '-d': {'name': '--scratch_dir', 'type': str, 'default': None, 'help': 'Directory for the per-run slice directory, e.g. a tmpfs mount such as /dev/shm'},
+        '-q': {'name': '--queue', 'type': str, 'default': None, 'choices': ['init', 'work', 'join'], 'help': 'Shared-filesystem queue mode step, the run directory is created in --scratch_dir'},
+        '-T': {'name': '--claim_timeout', 'type': float, 'default': None, 'help': 'Seconds after which a queue claim of a dead worker is taken over'}
     }
 
     for arg, properties in args_dict.items():
@@ -169,11 +1180,38 @@ def main() -> None:
     None
     """
     args = parseArguments()
+    chunk_memory = int(args.chunk_memory * 2**20) if args.chunk_memory else None
+    if args.num_processes is None and args.queue != 'join':
+        args.num_processes = recommendNumProcesses(chunk_memory)
+
+    if args.queue:
+        run_dir = os.path.join(args.scratch_dir or '.', f'{os.path.basename(args.results_df_path)[:-4]}_slices')
+        try:
+            if args.queue == 'init':
+                initQueue(args.target, args.results_df_path, slices_num=args.num_processes, chunksize=args.chunksize, slice_format=args.slice_format, scratch_dir=args.scratch_dir)
+            elif args.queue == 'work':
+                processed = runQueueWorkers(run_dir, num_processes=args.num_processes, max_retries=args.max_retries, claim_timeout=args.claim_timeout, retry_failed=args.resume)
+                logger.info(f'Processed {processed} slices of {run_dir} on {socket.gethostname()}.')
+            else:
+                joinQueue(run_dir, f'{os.path.basename(args.results_df_path)[:-4]}_all.csv')
+        except RuntimeError as e:
+            logger.error(e)
+            raise SystemExit(1)
+        return
 
     logger.info(f'Running {args.target} on {args.results_df_path} in parallel on {args.num_processes} processes...')
-    runMainPool(args.target, args.results_df_path, num_processes=args.num_processes)
+    try:
+        if args.chunksize:
+            runStreamingPool(args.target, args.results_df_path, num_processes=args.num_processes, chunksize=args.chunksize, output_format=args.output_format, max_retries=args.max_retries, resume=args.resume, slice_format=args.slice_format, scratch_dir=args.scratch_dir)
+            output_format = args.output_format
+        else:
+            runMainPool(args.target, args.results_df_path, num_processes=args.num_processes, max_retries=args.max_retries, resume=args.resume, slice_format=args.slice_format, scratch_dir=args.scratch_dir)
+            output_format = 'csv'
+    except RuntimeError as e:
+        logger.error(e)
+        raise SystemExit(1)
     logger.info(f'Finished running {args.target} on {args.results_df_path} in parallel on {args.num_processes} processes...')
-    logger.info(f'Output saved to {args.results_df_path[:-4]}_all.csv')
+    logger.info(f'Output saved to {os.path.basename(args.results_df_path)[:-4]}_all.{output_format}')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
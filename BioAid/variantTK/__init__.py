@@ -1,4 +1,24 @@
 # This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
 # Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
 
-from .variants import *
\ No newline at end of file
+from ..lazyImports import attachLazyImports
+
+#submodules are only imported when one of their names is first used
+__getattr__, __dir__, __all__ = attachLazyImports(__name__, ['variants', 'nullModel', 'vcf', 'clusters', 'spectra'], {
+  '.variants': ['BASES', 'SPECTRA_TABLE', 'CLONE_KEYS', 'qualitySNPFilter', 'filterSNPFrame', 'splitAD',
+                'findDominantAFVectorized', 'findTypeVectorized', 'filterByAD', 'findDominantAF', 'findType',
+                'findZygosity', 'filterFromClones', 'prepareSNPMapFrame', 'drawDensityTracks', 'drawSNPMap',
+                'LinearGenome', 'asLinearGenome', 'findGenomeLength', 'generateRandomLoci', 'findChrInLinearGenome',
+                'findSpectraStrandwise', 'renameChrToRoman', 'draw_random_SNPMap', 'drawCombinedSNPMap',
+                'drawSNPMapsBatch'],
+  '.nullModel': ['BASE_CODES', 'contextName', 'encodeSequence', 'regionsToLinear', 'drawRandomLinearLoci',
+                 'buildContextIndex', 'findObservedContexts', 'drawContextMatchedLoci', 'linearBins',
+                 'countLociInBins', 'empiricalPValues', 'simulateNullCounts', 'permutationTest'],
+  '.vcf': ['readVCFHeader', 'findVariantType', 'parseSampleColumn', 'iterVCFChunks', 'concatCategoricalFrames',
+           'readVCF', 'streamQualitySNPFilter'],
+  '.clusters': ['STRAND_CODES', 'STRAND_NAMES', 'findMutatedStrand', 'combineSampleFrames', 'labelMutationClusters',
+                'findMutationClusters'],
+  '.spectra': ['SPECTRA_STRANDWISE_TABLE', 'SBS96_SUBSTITUTIONS', 'SBS96_LABELS', 'SBS96_TABLE', 'CONTEXT_NAMES',
+               'encodeBases', 'findSpectraStrandwiseVectorized', 'fetchReferenceBases', 'findSBS96',
+               'annotateSpectra', 'buildSignatureMatrix'],
+})
\ No newline at end of file
@@ -0,0 +1,105 @@
+# This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
+# Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
+
+## Contents:
+## findMutatedStrand
+## combineSampleFrames
+## labelMutationClusters
+## findMutationClusters
+
+import numpy as np
+import pandas as pd
+
+#Mutation clusters (e.g. kataegis) are runs of >= min_mutations variants of one sample on one chromosome
+#in which every inter-mutation distance is <= max_distance. Strand-coordinated clusters additionally
+#have all mutated bases on the same strand, i.e. all REF bases are pyrimidines (C/T, the C_to_*/T_to_*
+#classes of findSpectraStrandwise) or all are purines (G/A, the G_to_*/A_to_* classes).
+
+#strand codes of findMutatedStrand and their names in the cluster table
+STRAND_CODES = {'C': 1, 'T': 1, 'G': -1, 'A': -1}
+STRAND_NAMES = {1: '+', -1: '-', 0: ''}
+
+def findMutatedStrand(ref):
+  #strand of the mutated base from the REF column: 1 for C/T, -1 for G/A, 0 for anything else.
+  #Categorical columns are mapped through their categories only
+  strands = pd.Series(ref).map(STRAND_CODES)
+  return strands.astype(float).fillna(0).to_numpy(dtype=np.int8)
+
+def combineSampleFrames(frames_list, sample_names, columns=('CHROM', 'POS', 'REF', 'ALT')):
+  #stacks per-sample variant tables (e.g. from qualitySNPFilter or readVCF) into one long table with a SAMPLE column
+  frames = []
+  for sample, df in zip(sample_names, frames_list):
+    frame = df[[column for column in columns if column in df.columns]].copy()
+    frame['SAMPLE'] = sample
+    frames.append(frame)
+  return pd.concat(frames, ignore_index=True)
+
+def labelMutationClusters(df, max_distance=1000, min_mutations=6, strand_coordinated=False, sample_column='SAMPLE'):
+  #labels every variant with the id of the cluster it belongs to (-1 if none), aligned with the rows of df.
+  #Variants are sorted once by sample, chromosome and position and the clusters are cut where the
+  #sample or chromosome changes, the distance to the previous variant exceeds max_distance or
+  #(with strand_coordinated) the mutated strand changes. Clusters are numbered in that sort order.
+  n = len(df)
+  if n == 0:
+    return np.empty(0, dtype=np.int64)
+
+  chrom_codes = pd.factorize(df['CHROM'])[0]
+  if sample_column in df.columns:
+    sample_codes = pd.factorize(df[sample_column])[0]
+  else:
+    sample_codes = np.zeros(n, dtype=np.int64)
+  positions = df['POS'].to_numpy(dtype=np.int64)
+
+  order = np.lexsort((positions, chrom_codes, sample_codes))
+  positions = positions[order]
+  breaks = np.ones(n, dtype=bool)
+  breaks[1:] = ((sample_codes[order][1:] != sample_codes[order][:-1])
+                | (chrom_codes[order][1:] != chrom_codes[order][:-1])
+                | (np.diff(positions) > max_distance))
+  if strand_coordinated:
+    strands = findMutatedStrand(df['REF'])[order]
+    breaks[1:] |= strands[1:] != strands[:-1]
+    #variants without a defined strand never join a strand-coordinated cluster
+    breaks |= strands == 0
+    breaks[1:] |= strands[:-1] == 0
+
+  #runs of variants between breaks are the candidate clusters, small runs are dropped
+  runs = np.cumsum(breaks) - 1
+  run_sizes = np.bincount(runs)
+  is_cluster = run_sizes >= min_mutations
+  cluster_ids = np.cumsum(is_cluster) - 1
+  sorted_labels = np.where(is_cluster[runs], cluster_ids[runs], -1)
+
+  labels = np.empty(n, dtype=np.int64)
+  labels[order] = sorted_labels
+  return labels
+
+def findMutationClusters(df, max_distance=1000, min_mutations=6, strand_coordinated=False, sample_column='SAMPLE'):
+  #calls mutation clusters in a variant table with CHROM/POS (and REF for strand_coordinated) columns,
+  #optionally for many samples at once if a sample_column is present (see combineSampleFrames).
+  #Returns one row per cluster with its span, number of mutations, mean inter-mutation distance and strand.
+  labels = labelMutationClusters(df, max_distance=max_distance, min_mutations=min_mutations,
+                                 strand_coordinated=strand_coordinated, sample_column=sample_column)
+  clustered = labels >= 0
+  variants = pd.DataFrame({
+    'CLUSTER': labels[clustered],
+    'CHROM': df['CHROM'].to_numpy()[clustered],
+    'POS': df['POS'].to_numpy(dtype=np.int64)[clustered],
+  })
+  if sample_column in df.columns:
+    variants.insert(1, sample_column, df[sample_column].to_numpy()[clustered])
+  if 'REF' in df.columns:
+    variants['STRAND'] = findMutatedStrand(df['REF'])[clustered]
+
+  grouped = variants.groupby('CLUSTER', sort=True)
+  clusters = grouped[[column for column in (sample_column, 'CHROM') if column in variants.columns]].first()
+  clusters['START'] = grouped['POS'].min()
+  clusters['END'] = grouped['POS'].max()
+  clusters['MUTATIONS'] = grouped.size()
+  clusters['SPAN'] = clusters['END'] - clusters['START'] + 1
+  clusters['MEAN_DISTANCE'] = (clusters['SPAN'] - 1) / (clusters['MUTATIONS'] - 1)
+  if 'STRAND' in variants.columns:
+    #'+' or '-' if all mutated bases are on one strand, 'mixed' otherwise
+    strand_counts = grouped['STRAND'].nunique()
+    clusters['STRAND'] = grouped['STRAND'].first().map(STRAND_NAMES).where(strand_counts == 1, 'mixed')
+  return clusters.reset_index()
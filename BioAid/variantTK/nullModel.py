@@ -0,0 +1,234 @@
+# This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
+# Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
+
+## Contents:
+## contextName
+## encodeSequence
+## regionsToLinear
+## drawRandomLinearLoci
+## lociInRegions
+## buildContextIndex
+## findObservedContexts
+## drawContextMatchedLoci
+## linearBins
+## countLociInBins
+## empiricalPValues
+## simulateNullCounts
+## permutationTest
+
+import numpy as np
+import pandas as pd
+from .variants import asLinearGenome
+
+#Conventions: observed variants are CHROM/POS tables with 1-based (VCF) positions,
+#regions and features are BED-like CHROM/START/END tables (0-based, half-open, non-overlapping),
+#and all simulated loci are 0-based positions in the LinearGenome coordinate system.
+
+#A/C/G/T -> 0..3, anything else -> 4
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate("ACGT"):
+  BASE_CODES[ord(base)] = code
+  BASE_CODES[ord(base.lower())] = code
+
+def contextName(context_code):
+  #trinucleotide name of a context code 16*left+4*middle+right, e.g. 6 -> 'ACG'
+  return "ACGT"[context_code // 16] + "ACGT"[(context_code // 4) % 4] + "ACGT"[context_code % 4]
+
+def encodeSequence(sequence):
+  #DNA string to an array of base codes, vectorized through a 256-entry lookup table
+  return BASE_CODES[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+
+def regionsToLinear(genome, regions):
+  #BED-like CHROM/START/END table to sorted linear interval start and end arrays
+  genome = asLinearGenome(genome)
+  starts = genome.toLinear(regions["CHROM"], regions["START"])
+  ends = starts + (regions["END"].to_numpy(dtype=np.int64) - regions["START"].to_numpy(dtype=np.int64))
+  order = np.argsort(starts, kind="stable")
+  return starts[order], ends[order]
+
+def drawRandomLinearLoci(genome, size, rng, regions=None):
+  #uniform random linear loci (with replacement) of shape size, e.g. (replicates, n).
+  #If regions are given (e.g. mappable/callable regions as linear starts, ends),
+  #loci are drawn uniformly from the concatenated regions only.
+  genome = asLinearGenome(genome)
+  if regions is None:
+    return rng.integers(0, genome.length, size=size)
+
+  starts, ends = regions
+  cumulative = np.concatenate(([0], np.cumsum(ends - starts)))
+  draws = rng.integers(0, cumulative[-1], size=size)
+  region_index = np.searchsorted(cumulative, draws, side="right") - 1
+  return starts[region_index] + (draws - cumulative[region_index])
+
+def lociInRegions(loci, regions):
+  #boolean mask of the linear loci that fall inside linear regions (sorted starts, ends)
+  starts, ends = regions
+  region_index = np.searchsorted(starts, loci, side="right") - 1
+  return (region_index >= 0) & (loci < ends[np.maximum(region_index, 0)])
+
+def buildContextIndex(genome, reference, regions=None):
+  #sorted linear positions of every trinucleotide context, keyed by context code.
+  #reference is a {chromosome: sequence} dict or the [[title, sequence], ...] list of
+  #extractSeqFromFastaToList. Positions without a full ACGT context (chromosome ends, N) are left out.
+  #Memory is ~4 bytes per genome position, meant for genomes up to a few hundred Mb.
+  genome = asLinearGenome(genome)
+  if not isinstance(reference, dict):
+    reference = dict(reference)
+
+  position_dtype = np.uint32 if genome.length < 2**32 else np.int64
+  codes_list = []
+  positions_list = []
+  for chromosome, offset in zip(genome.names, genome.offsets[:-1]):
+    bases = encodeSequence(reference[chromosome]).astype(np.int16)
+    contexts = 16*bases[:-2] + 4*bases[1:-1] + bases[2:]
+    valid = (bases[:-2] < 4) & (bases[1:-1] < 4) & (bases[2:] < 4)
+    positions = np.flatnonzero(valid) + 1 + offset
+    codes_list.append(contexts[valid].astype(np.uint8))
+    positions_list.append(positions.astype(position_dtype))
+  codes = np.concatenate(codes_list)
+  positions = np.concatenate(positions_list)
+
+  if regions is not None:
+    inside = lociInRegions(positions, regions)
+    codes, positions = codes[inside], positions[inside]
+
+  order = np.argsort(codes, kind="stable")
+  codes, positions = codes[order], positions[order]
+  bounds = np.searchsorted(codes, np.arange(65))
+  return {code: positions[bounds[code]:bounds[code+1]] for code in range(64) if bounds[code+1] > bounds[code]}
+
+def findObservedContexts(genome, reference, observed_loci):
+  #trinucleotide context codes of linear loci, -1 where the context is not a full ACGT trinucleotide
+  genome = asLinearGenome(genome)
+  if not isinstance(reference, dict):
+    reference = dict(reference)
+  chromosomes, positions = genome.toChromosome(observed_loci)
+  contexts = np.full(len(positions), -1, dtype=np.int16)
+  for chromosome in pd.unique(chromosomes):
+    in_chr = chromosomes == chromosome
+    bases = encodeSequence(reference[chromosome]).astype(np.int16)
+    chr_positions = positions[in_chr]
+    has_flanks = (chr_positions > 0) & (chr_positions < len(bases) - 1)
+    chr_positions = np.clip(chr_positions, 1, len(bases) - 2)
+    left, middle, right = bases[chr_positions-1], bases[chr_positions], bases[chr_positions+1]
+    valid = has_flanks & (left < 4) & (middle < 4) & (right < 4)
+    contexts[in_chr] = np.where(valid, 16*left + 4*middle + right, -1)
+  return contexts
+
+def drawContextMatchedLoci(context_index, context_counts, replicates, rng):
+  #random linear loci of shape (replicates, n) with the same number of loci per trinucleotide
+  #context as observed; context_counts maps context codes to observed counts
+  columns = []
+  for code, count in context_counts.items():
+    if count == 0:
+      continue
+    if code not in context_index:
+      raise ValueError(f"Context {contextName(code)} was observed but does not occur in the (allowed) reference")
+    positions = context_index[code]
+    columns.append(positions[rng.integers(0, len(positions), size=(replicates, count))].astype(np.int64))
+  if not columns:
+    raise ValueError("No variants with a usable (full ACGT) trinucleotide context remain to match")
+  return np.concatenate(columns, axis=1)
+
+def linearBins(genome, features=None):
+  #bins for countLociInBins: whole chromosomes by default, or BED-like features.
+  #Returns the sorted bin edges, the bin names and whether the bins are features
+  genome = asLinearGenome(genome)
+  if features is None:
+    return genome.offsets, list(genome.names), False
+
+  starts, ends = regionsToLinear(genome, features)
+  if (starts[1:] < ends[:-1]).any():
+    raise ValueError("Features must not overlap, merge them first")
+  order = np.argsort(genome.toLinear(features["CHROM"], features["START"]), kind="stable")
+  if "NAME" in features.columns:
+    names = list(features["NAME"].to_numpy()[order])
+  else:
+    names = [f"{c}:{s}-{e}" for c, s, e in zip(features["CHROM"].to_numpy()[order], features["START"].to_numpy()[order], features["END"].to_numpy()[order])]
+  edges = np.empty(2*len(starts), dtype=np.int64)
+  edges[0::2], edges[1::2] = starts, ends
+  return edges, names, True
+
+def countLociInBins(loci, bins):
+  #counts loci per bin for every replicate at once. loci is a (replicates, n) array,
+  #returns a (replicates, bins) array. Loci between features are not counted.
+  edges, names, are_features = bins
+  loci = np.atleast_2d(loci)
+  n_bins = len(names)
+  bin_index = np.searchsorted(edges, loci, side="right") - 1
+  if are_features:
+    inside = (bin_index >= 0) & (bin_index % 2 == 0)
+    bin_index = np.where(inside, bin_index // 2, -1)
+  else:
+    bin_index = np.where(bin_index < n_bins, bin_index, -1)
+
+  #offset each replicate's bins so a single bincount counts all replicates
+  replicate_offsets = (np.arange(loci.shape[0]) * n_bins)[:, None]
+  flat = (bin_index + replicate_offsets)[bin_index >= 0]
+  return np.bincount(flat, minlength=loci.shape[0]*n_bins).reshape(loci.shape[0], n_bins)
+
+def empiricalPValues(observed_counts, simulated_counts, names):
+  #one-sided empirical p-values with the (1+k)/(1+R) correction, per bin
+  replicates = simulated_counts.shape[0]
+  return pd.DataFrame({
+    "bin": names,
+    "observed": observed_counts,
+    "expected": simulated_counts.mean(axis=0),
+    "expected_sd": simulated_counts.std(axis=0),
+    "p_enriched": (1 + (simulated_counts >= observed_counts).sum(axis=0)) / (1 + replicates),
+    "p_depleted": (1 + (simulated_counts <= observed_counts).sum(axis=0)) / (1 + replicates),
+  })
+
+def simulateNullCounts(genome, n, replicates=1000, features=None, regions=None, context_counts=None, reference=None, seed=None, max_loci_per_chunk=10_000_000):
+  #draws replicates x n random loci and counts them per chromosome (or per feature).
+  #Replicates are simulated in chunks of at most max_loci_per_chunk loci, only the counts are kept.
+  #regions restricts the draws to a BED-like table of mappable/callable regions,
+  #context_counts ({context code: count}, with reference) matches the trinucleotide contexts.
+  genome = asLinearGenome(genome)
+  rng = np.random.default_rng(seed)
+  bins = linearBins(genome, features)
+  linear_regions = regionsToLinear(genome, regions) if regions is not None else None
+  context_index = buildContextIndex(genome, reference, linear_regions) if context_counts is not None else None
+
+  counts = np.empty((replicates, len(bins[1])), dtype=np.int64)
+  chunk = max(1, max_loci_per_chunk // max(n, 1))
+  for first in range(0, replicates, chunk):
+    size = min(chunk, replicates - first)
+    if context_index is not None:
+      loci = drawContextMatchedLoci(context_index, context_counts, size, rng)
+    else:
+      loci = drawRandomLinearLoci(genome, (size, n), rng, linear_regions)
+    counts[first:first+size] = countLociInBins(loci, bins)
+  return counts, bins[1]
+
+def permutationTest(observed_df, chromosomes, replicates=1000, features=None, regions=None, match_context=False, reference=None, seed=None, max_loci_per_chunk=10_000_000):
+  #tests whether observed mutations (CHROM/POS table, 1-based POS) are enriched or depleted
+  #per chromosome, or per feature, against a uniform null of the same number of random loci.
+  #With match_context=True the null keeps the observed trinucleotide contexts (needs reference).
+  #regions (BED-like) restricts both the null and the observed variants, variants outside are left out.
+  #Returns observed and expected counts with empirical p-values per bin.
+  genome = asLinearGenome(chromosomes)
+  observed_loci = genome.toLinear(observed_df["CHROM"], observed_df["POS"].to_numpy(dtype=np.int64) - 1)
+
+  if regions is not None:
+    inside = lociInRegions(observed_loci, regionsToLinear(genome, regions))
+    if not inside.all():
+      print(f"WARNING! {(~inside).sum()} variants outside the regions are left out")
+    observed_loci = observed_loci[inside]
+
+  context_counts = None
+  if match_context:
+    if reference is None:
+      raise ValueError("match_context=True needs the reference sequences")
+    contexts = findObservedContexts(genome, reference, observed_loci)
+    if (contexts < 0).any():
+      print(f"WARNING! {(contexts < 0).sum()} variants without a full ACGT context are left out")
+    observed_loci = observed_loci[contexts >= 0]
+    codes, code_counts = np.unique(contexts[contexts >= 0], return_counts=True)
+    context_counts = dict(zip(codes.tolist(), code_counts.tolist()))
+
+  bins = linearBins(genome, features)
+  observed_counts = countLociInBins(observed_loci[None, :], bins)[0]
+  simulated_counts, names = simulateNullCounts(genome, len(observed_loci), replicates=replicates, features=features, regions=regions,
+                                               context_counts=context_counts, reference=reference, seed=seed, max_loci_per_chunk=max_loci_per_chunk)
+  return empiricalPValues(observed_counts, simulated_counts, names)
@@ -0,0 +1,115 @@
+# This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
+# Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
+
+## Contents:
+## encodeBases
+## findSpectraStrandwiseVectorized
+## fetchReferenceBases
+## findSBS96
+## annotateSpectra
+## buildSignatureMatrix
+
+import numpy as np
+import pandas as pd
+from .variants import BASES, findTypeVectorized
+from .nullModel import BASE_CODES
+
+#Batch versions of findType (6 classes, SPECTRA), findSpectraStrandwise (12 classes, SPECTRA_STRANDWISE)
+#and SBS96 trinucleotide labels (e.g. 'A[C>T]G', pyrimidine reference in the middle). All classes are
+#looked up in tables indexed by base codes (A/C/G/T -> 0..3, BASES order), non-SNPs get None.
+
+#12 strandwise classes, indexed by 4*REF+ALT
+SPECTRA_STRANDWISE_TABLE = np.array([None if ref == alt else f'{ref}_to_{alt}' for ref in BASES for alt in BASES], dtype=object)
+
+#SBS96 labels in the usual signature matrix order: substitution, then 5' base, then 3' base
+SBS96_SUBSTITUTIONS = ['C>A', 'C>G', 'C>T', 'T>A', 'T>C', 'T>G']
+SBS96_LABELS = [f'{left}[{substitution}]{right}' for substitution in SBS96_SUBSTITUTIONS for left in BASES for right in BASES]
+
+#SBS96 label index by 64*left+16*ref+4*alt+right of the pyrimidine-centered trinucleotide, -1 if not a pyrimidine SNP
+SBS96_TABLE = np.full(256, -1, dtype=np.int16)
+for index, label in enumerate(SBS96_LABELS):
+  left, ref, alt, right = (BASES.index(base) for base in (label[0], label[2], label[4], label[6]))
+  SBS96_TABLE[64*left + 16*ref + 4*alt + right] = index
+
+#trinucleotide names by 36*left+6*middle+right of the fetchReferenceBases codes (4 is N, -1 beyond the ends is '-')
+CONTEXT_NAMES = np.array([a + b + c for a in 'ACGTN-' for b in 'ACGTN-' for c in 'ACGTN-'], dtype=object)
+
+def encodeBases(bases):
+  #REF/ALT-like column to base codes (A/C/G/T -> 0..3), -1 for anything that is not a single base
+  return pd.Categorical(pd.Series(bases).to_numpy(), categories=BASES).codes.astype(np.int64)
+
+def findSpectraStrandwiseVectorized(ref, alt):
+  #vectorized findSpectraStrandwise: the 12 classes keep the reference base as it is (e.g. G_to_A)
+  ref_codes, alt_codes = encodeBases(ref), encodeBases(alt)
+  valid = (ref_codes >= 0) & (alt_codes >= 0)
+  spectra = np.full(len(ref_codes), None, dtype=object)
+  spectra[valid] = SPECTRA_STRANDWISE_TABLE[4*ref_codes[valid] + alt_codes[valid]]
+  return spectra
+
+def fetchReferenceBases(reference, chromosomes, positions, flank=1):
+  #base codes around 1-based positions, as a (n, 2*flank+1) array (-1 beyond the chromosome ends, 4 for N etc.).
+  #reference is a {chromosome: sequence} dict or the [[title, sequence], ...] list of extractSeqFromFastaToList.
+  #Bases are gathered from the raw bytes of each chromosome, nothing else of the genome is encoded.
+  if not isinstance(reference, dict):
+    reference = dict(reference)
+  chromosomes = pd.Series(chromosomes).to_numpy()
+  positions = np.asarray(positions, dtype=np.int64) - 1
+  offsets = np.arange(-flank, flank + 1)
+  bases = np.full((len(positions), len(offsets)), -1, dtype=np.int16)
+
+  for chromosome in pd.unique(chromosomes):
+    if chromosome not in reference:
+      raise ValueError(f"Chromosome {chromosome} is not in the reference")
+    sequence = np.frombuffer(reference[chromosome].encode(), dtype=np.uint8)
+    in_chr = chromosomes == chromosome
+    window = positions[in_chr, None] + offsets
+    inside = (window >= 0) & (window < len(sequence))
+    bases[in_chr] = np.where(inside, BASE_CODES[sequence[np.clip(window, 0, len(sequence) - 1)]].astype(np.int16), -1)
+  return bases
+
+def findSBS96(ref, alt, context):
+  #SBS96 label indices (SBS96_LABELS, -1 if none) from REF/ALT and a (n, 3) reference context of base codes.
+  #Purine references are reverse complemented, e.g. G>A in TGC becomes G[C>T]A
+  ref_codes, alt_codes = encodeBases(ref), encodeBases(alt)
+  left, middle, right = context[:, 0].astype(np.int64), context[:, 1].astype(np.int64), context[:, 2].astype(np.int64)
+  valid = ((ref_codes >= 0) & (alt_codes >= 0) & (ref_codes != alt_codes) & (middle == ref_codes)
+           & (left >= 0) & (left < 4) & (right >= 0) & (right < 4))
+
+  #in ACGT order the complement of code b is 3-b
+  purine = (ref_codes == 0) | (ref_codes == 2)
+  left, right = np.where(purine, 3 - right, left), np.where(purine, 3 - left, right)
+  ref_codes = np.where(purine, 3 - ref_codes, ref_codes)
+  alt_codes = np.where(purine, 3 - alt_codes, alt_codes)
+
+  index = np.where(valid, 64*left + 16*ref_codes + 4*alt_codes + right, 0)
+  return np.where(valid, SBS96_TABLE[index], -1)
+
+def annotateSpectra(df, reference=None):
+  #adds SPECTRA (6 classes), SPECTRA_STRANDWISE (12 classes) and, with a reference, the trinucleotide
+  #CONTEXT and the SBS96 label to a CHROM/POS/REF/ALT table. SNPs whose REF does not match the
+  #reference get no SBS96 label.
+  df = df.copy()
+  df['SPECTRA'] = findTypeVectorized(df['REF'], df['ALT'])
+  df['SPECTRA_STRANDWISE'] = findSpectraStrandwiseVectorized(df['REF'], df['ALT'])
+
+  if reference is not None:
+    context = fetchReferenceBases(reference, df['CHROM'], df['POS'])
+    symbols = np.where(context < 0, 5, context).astype(np.int64)
+    df['CONTEXT'] = CONTEXT_NAMES[36*symbols[:, 0] + 6*symbols[:, 1] + symbols[:, 2]]
+    sbs96 = findSBS96(df['REF'], df['ALT'], context)
+    ref_codes, alt_codes = encodeBases(df['REF']), encodeBases(df['ALT'])
+    snps = (ref_codes >= 0) & (alt_codes >= 0) & (ref_codes != alt_codes)
+    mismatches = (snps & (ref_codes != context[:, 1])).sum()
+    if mismatches:
+      print(f"WARNING! REF of {mismatches} SNPs does not match the reference")
+    df['SBS96'] = pd.Categorical.from_codes(sbs96, categories=SBS96_LABELS)
+  return df
+
+def buildSignatureMatrix(frames_list, sample_names, reference):
+  #SBS96 mutation counts of every sample (96 rows x samples columns), e.g. for signature fitting
+  counts = {}
+  for sample, df in zip(sample_names, frames_list):
+    context = fetchReferenceBases(reference, df['CHROM'], df['POS'])
+    sbs96 = findSBS96(df['REF'], df['ALT'], context)
+    counts[sample] = np.bincount(sbs96[sbs96 >= 0], minlength=len(SBS96_LABELS))
+  return pd.DataFrame(counts, index=pd.Index(SBS96_LABELS, name='SBS96'))
@@ -3,12 +3,19 @@
 
 ## Contents:
 ## qualitySNPFilter
+## filterSNPFrame
+## splitAD
+## findDominantAFVectorized
+## findTypeVectorized
 ## filterByAD
 ## findDominantAF
 ## findType
 ## findZygosity
 ## filterFromClones
+## prepareSNPMapFrame
+## drawDensityTracks
 ## drawSNPMap
+## LinearGenome
 ## findGenomeLength
 ## generateRandomLoci
 ## findChrInLinearGenome
@@ -16,36 +23,80 @@
 ## renameChrToRoman
 ## draw_random_SNPMap
 ## drawCombinedSNPMap
+## drawSNPMapsBatch
 
 import os
 import random
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from natsort import index_natsorted
-import seaborn as sns
-from numpy.core.numeric import NaN
+from natsort import natsorted
 
+#lookup table of the 6 SNP classes (collapsed to the pyrimidine of the pair), indexed by 4*REF+ALT in BASES order
+BASES = ['A', 'C', 'G', 'T']
+SPECTRA_TABLE = np.array([None,     'T_to_G', 'T_to_C', 'T_to_A',
+                          'C_to_A', None,     'C_to_G', 'C_to_T',
+                          'C_to_T', 'C_to_G', None,     'C_to_A',
+                          'T_to_A', 'T_to_C', 'T_to_G', None], dtype=object)
 
-def qualitySNPFilter(frames_list):
+#columns identifying the same variant in different samples for filterFromClones
+CLONE_KEYS = {'allele': ['CHROM', 'POS', 'REF', 'ALT'],
+              'position': ['CHROM', 'POS']}
+
+
+def qualitySNPFilter(frames_list, min_af=0.35, min_alt_reads=5, min_depth=10):
 
   for i in range(len(frames_list)):
-    frames_list[i] = frames_list[i][frames_list[i].TYPE =='SNP']
-    frames_list[i] = frames_list[i].rename(columns=lambda c: 'AF' if 'AF' in c else c)
-    frames_list[i] = frames_list[i].rename(columns=lambda c: 'AD' if 'AD' in c else c)
-    
-    #this line may be problematic for a good result and if not needed comment out
-    frames_list[i]['AF'] = frames_list[i].apply(lambda row: findDominantAF(row), axis=1)
-
-    frames_list[i] = frames_list[i].astype({'AF': float})
-    frames_list[i] = frames_list[i][frames_list[i].AF >= 0.35]
-    #also filter out 1.5n variants?
-
-    frames_list[i]['EVAL_AD'] = frames_list[i].apply(lambda row: filterByAD(row), axis=1)
-    frames_list[i] = frames_list[i][frames_list[i].EVAL_AD == 'True']
-    frames_list[i]['SPECTRA'] = frames_list[i].apply(lambda row: findType(row.REF, row.ALT), axis=1)
+    frames_list[i] = filterSNPFrame(frames_list[i], min_af=min_af, min_alt_reads=min_alt_reads, min_depth=min_depth)
   return frames_list
 
+def filterSNPFrame(df, min_af=0.35, min_alt_reads=5, min_depth=10):
+  #vectorized equivalent of the findDominantAF/filterByAD/findType row-wise passes,
+  #all thresholds are applied at once as a boolean mask over the parsed AF/AD columns
+  df = df[df.TYPE == 'SNP']
+  df = df.rename(columns=lambda c: 'AF' if 'AF' in c else c)
+  df = df.rename(columns=lambda c: 'AD' if 'AD' in c else c)
+
+  #this line may be problematic for a good result and if not needed comment out
+  af = findDominantAFVectorized(df['AF'])
+  #also filter out 1.5n variants?
+
+  #tables streamed from a VCF (see readVCF) already hold numeric allele depths
+  if {'REF_DEPTH', 'ALT_DEPTH'}.issubset(df.columns):
+    ref_reads, alt_reads = df['REF_DEPTH'], df['ALT_DEPTH']
+  else:
+    ref_reads, alt_reads = splitAD(df['AD'])
+  mask = (af >= min_af) & (alt_reads >= min_alt_reads) & (ref_reads + alt_reads >= min_depth)
+
+  df = df[mask.to_numpy()].copy()
+  df['AF'] = af[mask].to_numpy()
+  df['EVAL_AD'] = 'True'
+  df['SPECTRA'] = findTypeVectorized(df['REF'], df['ALT'])
+  return df
+
+def splitAD(ad_series):
+  #splits 'ref,alt' allele depth strings into two numeric series, unparsable depths become NaN
+  ad = ad_series.astype(str).str.split(",", n=2, expand=True)
+  ref_reads = pd.to_numeric(ad[0], errors='coerce')
+  alt_reads = pd.to_numeric(ad[1], errors='coerce') if 1 in ad.columns else pd.Series(np.nan, index=ad_series.index)
+  return ref_reads, alt_reads
+
+def findDominantAFVectorized(af_series):
+  #numeric max of comma-separated allele frequencies, vectorized findDominantAF
+  if pd.api.types.is_numeric_dtype(af_series):
+    return af_series
+  af = af_series.astype(str).str.split(",", expand=True)
+  return af.apply(pd.to_numeric, errors='coerce').max(axis=1)
+
+def findTypeVectorized(ref_series, alt_series):
+  #vectorized findType: REF/ALT are coded as BASES indices and looked up in SPECTRA_TABLE,
+  #anything that is not a single canonical base (e.g. indels) gets None like in findType
+  ref_codes = pd.Categorical(ref_series, categories=BASES).codes.astype(np.int64)
+  alt_codes = pd.Categorical(alt_series, categories=BASES).codes.astype(np.int64)
+  valid = (ref_codes >= 0) & (alt_codes >= 0)
+  spectra = np.full(len(ref_codes), None, dtype=object)
+  spectra[valid] = SPECTRA_TABLE[4*ref_codes[valid] + alt_codes[valid]]
+  return spectra
+
 def filterByAD(row):
   reads=row['AD'].split(",")
   if int(reads[1]) < 5:
@@ -79,61 +130,154 @@ def findZygosity(row):
   else:
     return('Heterozygous')
 
-def filterFromClones(frames_list):
-  #this will subtract all common rows between normal/control and experimental
-  #sample. I might need to revist to filter variants by position only not all columns
+def filterFromClones(frames_list, key='allele'):
+  #this will subtract all variants shared between normal/control and experimental samples,
+  #leaving only the private variants of each sample. Variants are compared by key:
+  #'allele' (CHROM, POS, REF, ALT), 'position' (CHROM, POS) or a list of columns.
+  #All keys are hashed once and counted across samples in a single pass, instead of
+  #merging every sample with every other one.
+  key_columns = CLONE_KEYS[key] if isinstance(key, str) else list(key)
+  key_hashes = [pd.util.hash_pandas_object(df[key_columns], index=False) for df in frames_list]
+
+  #number of samples each key occurs in, duplicates within a sample are counted once
+  sample_counts = pd.concat([pd.Series(hashes.unique()) for hashes in key_hashes], ignore_index=True).value_counts()
+  shared_hashes = sample_counts.index[sample_counts > 1]
+
   subtracted_df_list = []
-  for df in frames_list:
-    temp_df = df.drop(columns=['AD','AF'])
-    len_original=len(temp_df)
-    for df_2 in frames_list:
-      if not df.equals(df_2):
-        df_2=df_2.drop(columns=['AD','AF'])
-        temp_df = pd.merge(temp_df,df_2, indicator=True, how='outer').query('_merge=="left_only"').drop('_merge', axis=1)
-
-    len_final=len(temp_df)
-    print(f"removed {len_original-len_final} rows from df")
+  for df, hashes in zip(frames_list, key_hashes):
+    temp_df = df[~hashes.isin(shared_hashes).to_numpy()].drop(columns=['AD','AF'], errors='ignore')
+    print(f"removed {len(df)-len(temp_df)} rows from df")
     subtracted_df_list.append(temp_df)
   return subtracted_df_list
 
-def drawSNPMap(pd_df, df_chr_lengths, chr_starts_df, title, sample_names, saveMap=True):
-
-  pd_df = pd_df.append(chr_starts_df, ignore_index=True)
+def prepareSNPMapFrame(pd_df, chr_starts_df):
+  #adds the centromere rows (pd.concat, DataFrame.append is gone in pandas 2) and sorts the
+  #chromosomes naturally (chr2 before chr10). Only the unique names are natsorted, the rows are
+  #ordered by their stable categorical codes.
+  pd_df = pd.concat([pd_df, chr_starts_df], ignore_index=True)
+  chromosome_order = natsorted(pd_df["CHROM"].dropna().unique())
+  codes = pd.Categorical(pd_df["CHROM"], categories=chromosome_order).codes
+  return pd_df.iloc[np.argsort(codes, kind="stable")].reset_index(drop=True)
+
+def drawDensityTracks(ax, pd_df, df_chr_lengths, bin_size=10000, cmap="Reds"):
+  #binned variant density drawn as a heat strip over every chromosome bar, for maps with too many
+  #points to scatter. Rows are matched to the bars by the names in df_chr_lengths["chromosome"], or,
+  #if those were renamed (renameChrToRoman), by natural order like the scatter rows.
+  import matplotlib.pyplot as plt
+  xlim, ylim = ax.get_xlim(), ax.get_ylim()
+  bar_names = list(df_chr_lengths["chromosome"])
+  map_names = natsorted(pd_df["CHROM"].dropna().unique())
+  if not set(map_names) & set(bar_names):
+    bar_names = map_names[:len(bar_names)]
+  chromosome_rows = {chromosome: row for row, chromosome in enumerate(bar_names)}
+  lengths = dict(zip(bar_names, df_chr_lengths["end_position"]))
+
+  tracks = {}
+  for chromosome, positions in pd_df.groupby("CHROM", observed=True)["POS"]:
+    if chromosome not in chromosome_rows:
+      continue
+    edges = np.append(np.arange(0, lengths[chromosome], bin_size), lengths[chromosome])
+    tracks[chromosome] = (np.histogram(positions.to_numpy(), bins=edges)[0], edges[-1])
+  vmax = max([counts.max() for counts, _ in tracks.values()] + [1])
+
+  image = None
+  for chromosome, (counts, end) in tracks.items():
+    row = chromosome_rows[chromosome]
+    image = ax.imshow(counts[None, :], extent=(0, end, row - 0.25, row + 0.25), aspect="auto", cmap=cmap,
+                      vmin=0, vmax=vmax, interpolation="nearest", zorder=1)
+  ax.set_xlim(xlim)
+  ax.set_ylim(ylim)
+  if image is not None:
+    plt.colorbar(image, ax=ax, label=f"variants per {bin_size} bp", pad=0.01)
+
+def drawSNPMap(pd_df, df_chr_lengths, chr_starts_df, title, sample_names, saveMap=True, max_points=50000, bin_size=10000):
+  #above max_points variants the map shows binned density tracks (see drawDensityTracks) instead of points
+  import matplotlib.pyplot as plt
+  import seaborn as sns
+
+  pd_df = prepareSNPMapFrame(pd_df, chr_starts_df)
 
   fig, ax = plt.subplots()
 
   df_chr_lengths.plot(kind='barh',legend=False, ax=ax, x="chromosome", y="end_position", fontsize=15, figsize=(20,6), edgecolor="black", linewidth=1, color="beige", zorder=0, title=title, label="Position")
   
-  pd_df = pd_df.sort_values(by="CHROM", key=lambda x: np.argsort(index_natsorted(pd_df["CHROM"])))
-  
   #To rename legend elements, change plot markers/colors, modify here
-  label_dict = { "G": "G->N", "C": "C->N", "A": "A->N", "T": "T->N", "REF": "Reference Allele"}
+  label_dict = { "G": "G->N", "C": "C->N", "A": "A->N", "T": "T->N", "REF": "Reference Allele", "cen": "Centromere"}
   markers = {"Homozygous": "x", "Heterozygous": "|"}
-  palette = {"G": "green", "C": "red", "A": "gray", "T": "gray"}
+  palette = {"G": "green", "C": "red", "A": "gray", "T": "gray", "cen": "white"}
 
-  sns.scatterplot(ax=ax,data=pd_df, x="POS", y="CHROM", hue="REF", palette=palette, style="ZYGOSITY", markers=markers, s=120, alpha=0.7,zorder=1, linewidth=1.5)
+  if (pd_df["REF"] != "cen").sum() > max_points:
+    #centromeres are not variants, they stay points over the density tracks
+    drawDensityTracks(ax, pd_df[pd_df["REF"] != "cen"], df_chr_lengths, bin_size=bin_size)
+    sns.scatterplot(ax=ax, data=pd_df[pd_df["REF"] == "cen"], x="POS", y="CHROM", hue="REF", palette=palette, marker="o", s=120, alpha=1, zorder=2, linewidth=1, edgecolor="black", rasterized=True)
+  else:
+    sns.scatterplot(ax=ax,data=pd_df, x="POS", y="CHROM", hue="REF", palette=palette, style="ZYGOSITY", markers=markers, s=120, alpha=0.7,zorder=1, linewidth=1.5, rasterized=True)
   
   ax.set_xlabel("POSITION")
   ax.set_ylabel("CHROMOSOME")
 
-  legend_texts = plt.legend().get_texts()
-  for i in range(len(legend_texts)):
-    label_str = legend_texts[i].get_text()
-    if label_str in label_dict:
-      new_label = label_dict.get(label_str)
+  if ax.get_legend_handles_labels()[0]:
+    legend_texts = plt.legend().get_texts()
+    for i in range(len(legend_texts)):
+      label_str = legend_texts[i].get_text()
+      if label_str in label_dict:
+        new_label = label_dict.get(label_str)
 
-      legend_texts[i].set_text(new_label)
+        legend_texts[i].set_text(new_label)
 
   if saveMap:
     plt.savefig('figures/'+title+'.png', transparent=False)
 
-def findGenomeLength(chromosomes):
+class LinearGenome:
+  #chromosomes laid end to end in one 0-based linear coordinate system. The cumulative
+  #offsets are computed once, and whole arrays of loci are converted both ways with
+  #np.searchsorted instead of walking the chromosome list for every locus.
+  #chromosomes is a list of [name, length] pairs, as used by generateRandomLoci.
+
+  def __init__(self, chromosomes):
+    self.names = np.array([chromosome[0] for chromosome in chromosomes], dtype=object)
+    self.lengths = np.array([chromosome[1] for chromosome in chromosomes], dtype=np.int64)
+    self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+    self.length = int(self.offsets[-1])
+    self._names_index = pd.Index(self.names)
+
+  @classmethod
+  def fromChrLengths(cls, df_chr_lengths, name_column="chromosome", length_column="end_position"):
+    #builds the genome from the chromosome lengths table used by the SNP map functions
+    return cls(df_chr_lengths[[name_column, length_column]].values.tolist())
+
+  def chrLengthsDF(self):
+    #chromosome lengths table in the format expected by the SNP map functions
+    return pd.DataFrame({"chromosome": self.names, "end_position": self.lengths})
+
+  def __len__(self):
+    return self.length
+
+  def toChromosome(self, loci):
+    #converts linear loci to (chromosome names, positions within the chromosomes) arrays
+    loci = np.asarray(loci, dtype=np.int64)
+    if loci.size and ((loci.min() < 0) | (loci.max() >= self.length)):
+      raise ValueError(f"Loci must be within the linear genome [0, {self.length})")
+    chr_index = np.searchsorted(self.offsets, loci, side='right') - 1
+    return self.names[chr_index], loci - self.offsets[chr_index]
+
+  def toLinear(self, chromosomes, positions):
+    #converts chromosome names and positions within the chromosomes to linear loci
+    chr_index = self._names_index.get_indexer(np.asarray(chromosomes, dtype=object))
+    if (chr_index == -1).any():
+      missing = pd.unique(np.asarray(chromosomes, dtype=object)[chr_index == -1])
+      raise ValueError(f"Chromosomes not in the linear genome: {list(missing)}")
+    return self.offsets[chr_index] + np.asarray(positions, dtype=np.int64)
+
+def asLinearGenome(chromosomes):
+  #lets functions accept either a LinearGenome or a list of [name, length] pairs
+  if isinstance(chromosomes, LinearGenome):
+    return chromosomes
+  return LinearGenome(chromosomes)
 
-  genome_length = 0
-  for chr in chromosomes:
-    genome_length+=chr[1]
+def findGenomeLength(chromosomes):
 
-  return(genome_length)
+  return(asLinearGenome(chromosomes).length)
 
 def generateRandomLoci(n, chromosomes):
 
@@ -142,21 +286,13 @@ def generateRandomLoci(n, chromosomes):
 
 def findChrInLinearGenome(chromosomes, random_loci):
 
-  output_list=[]
-  for locus in random_loci:
-    linear_genome_slider=0
-    linear_genome_slider_previous=0
-    for chromosome in chromosomes:
-      linear_genome_slider+=chromosome[1]
-
-      if locus < linear_genome_slider:
-        #print(f'slider:{linear_genome_slider}, chr:{chromosome[0]}, locus:{locus}')
-        output_list.append([chromosome[0], locus-linear_genome_slider_previous])
-        linear_genome_slider_previous+=chromosome[1]
-        break
-      linear_genome_slider_previous+=chromosome[1]
+  genome = asLinearGenome(chromosomes)
+  loci = np.asarray(random_loci, dtype=np.int64)
+  #loci outside of the genome are skipped
+  loci = loci[(loci >= 0) & (loci < genome.length)]
+  chr_names, positions = genome.toChromosome(loci)
 
-  return(output_list)
+  return([[chr_name, position] for chr_name, position in zip(chr_names.tolist(), positions.tolist())])
 
 def findSpectraStrandwise(colA, colB):
   if ((colA == 'C') & (colB == 'T')):
@@ -205,7 +341,10 @@ def renameChrToRoman(df):
   df.replace({"chromosome": roman_names}, inplace=True)
   return(df)
 
-def draw_random_SNPMap(pd_df, df_chr_lengths, chr_starts_df, title, saveMap=True):
+def draw_random_SNPMap(pd_df, df_chr_lengths, chr_starts_df, title, saveMap=True, max_points=50000, bin_size=10000):
+  #above max_points loci the map shows binned density tracks (see drawDensityTracks), centromeres stay points
+  import matplotlib.pyplot as plt
+  import seaborn as sns
 
   #To rename legend elements, change plot markers/colors, modify here
 
@@ -214,8 +353,7 @@ def draw_random_SNPMap(pd_df, df_chr_lengths, chr_starts_df, title, saveMap=True
   palette = {"random": "black", "cen": "white"}
 
   
-  pd_df = pd_df.append(chr_starts_df, ignore_index=True)
-  pd_df = pd_df.sort_values(by="CHROM", key=lambda x: np.argsort(index_natsorted(pd_df["CHROM"])))
+  pd_df = prepareSNPMapFrame(pd_df, chr_starts_df)
   renameChrToRoman(pd_df)
 
 
@@ -224,24 +362,31 @@ def draw_random_SNPMap(pd_df, df_chr_lengths, chr_starts_df, title, saveMap=True
   renameChrToRoman(df_chr_lengths)
 
   df_chr_lengths.plot(kind='barh',legend=False, ax=ax, x="chromosome", y="end_position", fontsize=40, figsize=(80,24), edgecolor="black", linewidth=1, color="lightgray", zorder=0, label="Position")
-  sns.scatterplot(ax=ax, data=pd_df, x="POS", y="CHROM", style="REF", markers=markers, hue="REF", palette=palette, s=1500, alpha=1,zorder=1, linewidth=1, edgecolor="black", legend=False)
+  if (pd_df["REF"] != "cen").sum() > max_points:
+    drawDensityTracks(ax, pd_df[pd_df["REF"] != "cen"], df_chr_lengths, bin_size=bin_size)
+    pd_df = pd_df[pd_df["REF"] == "cen"]
+  sns.scatterplot(ax=ax, data=pd_df, x="POS", y="CHROM", style="REF", markers=markers, hue="REF", palette=palette, s=1500, alpha=1,zorder=2, linewidth=1, edgecolor="black", legend=False, rasterized=True)
 
   ax.set_xlabel("POSITION", fontsize=40)
   ax.set_ylabel("CHROMOSOME", fontsize=40)
   fig.suptitle(title, fontsize=60)
 
-  legend_texts = plt.legend().get_texts()
-  for i in range(len(legend_texts)):
-    label_str = legend_texts[i].get_text()
-    if label_str in label_dict:
-      new_label = label_dict.get(label_str)
+  if ax.get_legend_handles_labels()[0]:
+    legend_texts = plt.legend().get_texts()
+    for i in range(len(legend_texts)):
+      label_str = legend_texts[i].get_text()
+      if label_str in label_dict:
+        new_label = label_dict.get(label_str)
 
-      legend_texts[i].set_text(new_label)
+        legend_texts[i].set_text(new_label)
 
   if saveMap:
     plt.savefig('figures/'+title+'.png', transparent=False, dpi=200)
 
-def drawCombinedSNPMap(pd_df, df_chr_lengths, chr_starts_df, title, sample_names, saveMap=True):
+def drawCombinedSNPMap(pd_df, df_chr_lengths, chr_starts_df, title, sample_names, saveMap=True, max_points=50000, bin_size=10000):
+  #above max_points variants the map shows binned density tracks (see drawDensityTracks), centromeres stay points
+  import matplotlib.pyplot as plt
+  import seaborn as sns
 
   #To rename legend elements, change plot markers/colors, modify here
   label_dict = { "G": "G->N",
@@ -279,8 +424,7 @@ def drawCombinedSNPMap(pd_df, df_chr_lengths, chr_starts_df, title, sample_names
              'T_to_G': "gray",
              'cen': "white"}
 
-  pd_df = pd_df.append(chr_starts_df, ignore_index=True)
-  pd_df = pd_df.sort_values(by="CHROM", key=lambda x: np.argsort(index_natsorted(pd_df["CHROM"])))
+  pd_df = prepareSNPMapFrame(pd_df, chr_starts_df)
   renameChrToRoman(pd_df)
   
   fig, ax = plt.subplots()
@@ -288,8 +432,12 @@ def drawCombinedSNPMap(pd_df, df_chr_lengths, chr_starts_df, title, sample_names
   renameChrToRoman(df_chr_lengths)
   df_chr_lengths.plot(kind='barh',legend=False, ax=ax, x="chromosome", y="end_position", fontsize=10, figsize=(20,6), edgecolor="black", linewidth=1, color="lightgray", zorder=0, label="Position")
 
-  sns.scatterplot(ax=ax, data=pd_df[pd_df["REF"].isin(["C",'cen'])], x="POS", y="CHROM", hue="SPECTRA_STRANDWISE", palette=palette, style="SPECTRA_STRANDWISE", markers=markers, s=100, alpha=.9,zorder=1, linewidth=.05, edgecolor="black", legend = False)
-  sns.scatterplot(ax=ax, data=pd_df[pd_df["REF"].isin(["G",'cen'])], x="POS", y="CHROM", hue="SPECTRA_STRANDWISE", palette=palette, style="SPECTRA_STRANDWISE", markers=markers, s=100, alpha=.9,zorder=2, linewidth=.15, edgecolor="black")
+  if pd_df["REF"].isin(["C", "G"]).sum() > max_points:
+    drawDensityTracks(ax, pd_df[pd_df["REF"].isin(["C", "G"])], df_chr_lengths, bin_size=bin_size)
+    sns.scatterplot(ax=ax, data=pd_df[pd_df["REF"] == "cen"], x="POS", y="CHROM", hue="SPECTRA_STRANDWISE", palette=palette, style="SPECTRA_STRANDWISE", markers=markers, s=100, alpha=.9,zorder=2, linewidth=.15, edgecolor="black", rasterized=True)
+  else:
+    sns.scatterplot(ax=ax, data=pd_df[pd_df["REF"].isin(["C",'cen'])], x="POS", y="CHROM", hue="SPECTRA_STRANDWISE", palette=palette, style="SPECTRA_STRANDWISE", markers=markers, s=100, alpha=.9,zorder=1, linewidth=.05, edgecolor="black", legend = False, rasterized=True)
+    sns.scatterplot(ax=ax, data=pd_df[pd_df["REF"].isin(["G",'cen'])], x="POS", y="CHROM", hue="SPECTRA_STRANDWISE", palette=palette, style="SPECTRA_STRANDWISE", markers=markers, s=100, alpha=.9,zorder=2, linewidth=.15, edgecolor="black", rasterized=True)
 
   ax.set_xlabel("POSITION", fontsize=10)
   ax.set_ylabel("CHROMOSOME", fontsize=10)
@@ -304,3 +452,28 @@ def drawCombinedSNPMap(pd_df, df_chr_lengths, chr_starts_df, title, sample_names
 
   if saveMap:
     plt.savefig('figures/'+title+'.png', transparent=False, dpi=600)
+
+def _drawSNPMapWorker(args):
+  #renders one map off-screen in a worker process and frees the figure
+  import inspect
+  import matplotlib
+  matplotlib.use("Agg")
+  import matplotlib.pyplot as plt
+  map_function, pd_df, df_chr_lengths, chr_starts_df, title, kwargs = args
+  if "sample_names" in inspect.signature(map_function).parameters:
+    kwargs = {"sample_names": [title], **kwargs}
+  map_function(pd_df, df_chr_lengths.copy(), chr_starts_df, title, saveMap=True, **kwargs)
+  plt.close("all")
+  return 'figures/'+title+'.png'
+
+def drawSNPMapsBatch(frames_list, sample_names, df_chr_lengths, chr_starts_df, map_function=drawCombinedSNPMap, num_processes=None, **kwargs):
+  #renders one map per sample (titled with the sample name) into figures/ in a process pool.
+  #map_function is drawSNPMap, draw_random_SNPMap or drawCombinedSNPMap, kwargs are passed on
+  #(e.g. max_points, bin_size). Returns the paths of the saved maps.
+  from multiprocessing import Pool
+  if num_processes is None:
+    num_processes = min(len(frames_list), os.cpu_count() or 1)
+  os.makedirs("figures", exist_ok=True)
+  tasks = [(map_function, df, df_chr_lengths, chr_starts_df, sample, kwargs) for df, sample in zip(frames_list, sample_names)]
+  with Pool(max(num_processes, 1)) as pool:
+    return list(pool.imap(_drawSNPMapWorker, tasks))
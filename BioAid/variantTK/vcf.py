@@ -0,0 +1,153 @@
+# This code was developed and authored by Jerzy Twarowski in Malkova Lab at the University of Iowa 
+# Contact: jerzymateusz-twarowski@uiowa.edu, tvarovski1@gmail.com
+
+## Contents:
+## readVCFHeader
+## findVariantType
+## parseSampleColumn
+## iterVCFChunks
+## concatCategoricalFrames
+## readVCF
+## streamQualitySNPFilter
+
+import csv
+import gzip
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from .variants import filterSNPFrame
+
+#Streams VCF(.gz) files into compact per-sample variant tables with categorical CHROM/REF/ALT/TYPE,
+#int32 POS, float32 AF and int32 REF_DEPTH/ALT_DEPTH (the reference and first alternative allele
+#depths of the AD field), parsing only the columns and INFO/FORMAT fields that are needed.
+
+def readVCFHeader(vcf_path):
+  #returns the number of ## meta-information lines, the column names of the #CHROM line
+  #and the contig names declared in the header (empty if there are none)
+  opener = gzip.open if vcf_path.endswith(".gz") else open
+  meta_lines = 0
+  contigs = []
+  with opener(vcf_path, "rt") as f:
+    for line in f:
+      if line.startswith("##"):
+        meta_lines += 1
+        if line.startswith("##contig=<ID="):
+          contigs.append(line[len("##contig=<ID="):].split(",")[0].rstrip(">\n"))
+      elif line.startswith("#CHROM"):
+        return meta_lines, line.rstrip("\n").split("\t"), contigs
+  raise ValueError(f"{vcf_path} has no #CHROM header line")
+
+def findVariantType(ref, alt):
+  #vectorized variant type from REF/ALT strings: SNP (single bases), MNP (equal length substitutions),
+  #INDEL (any other base changes) or SYMBOLIC (<DEL>, breakends, * alleles)
+  ref_length = ref.str.len()
+  is_symbolic = alt.str.contains(r"[<>\[\]*.]", regex=True)
+  is_snp = (ref_length == 1) & alt.str.fullmatch(r"[ACGTN](,[ACGTN])*")
+  alt_lengths = alt.str.split(",", expand=True).apply(lambda column: column.str.len())
+  is_mnp = (ref_length > 1) & alt_lengths.max(axis=1).eq(ref_length) & alt_lengths.min(axis=1).eq(ref_length)
+  variant_type = np.select([is_symbolic, is_snp, is_mnp], ["SYMBOLIC", "SNP", "MNP"], default="INDEL")
+  return pd.Categorical(variant_type, categories=["SNP", "MNP", "INDEL", "SYMBOLIC"])
+
+def parseSampleColumn(format_column, sample_column):
+  #extracts AD and AF from a sample column, one vectorized split per distinct FORMAT string.
+  #Returns float arrays of the reference depth, first alternative depth and dominant AF (NaN if missing)
+  ref_depth = np.full(len(sample_column), np.nan)
+  alt_depth = np.full(len(sample_column), np.nan)
+  af = np.full(len(sample_column), np.nan)
+
+  for format_string in format_column.unique():
+    keys = format_string.split(":")
+    rows = (format_column == format_string).to_numpy()
+    fields = sample_column[rows].str.split(":", expand=True)
+    if "AD" in keys and keys.index("AD") in fields.columns:
+      ad = fields[keys.index("AD")].str.split(",", n=2, expand=True)
+      ref_depth[rows] = pd.to_numeric(ad[0], errors="coerce")
+      if 1 in ad.columns:
+        alt_depth[rows] = pd.to_numeric(ad[1], errors="coerce")
+    if "AF" in keys and keys.index("AF") in fields.columns:
+      af_values = fields[keys.index("AF")].str.split(",", expand=True)
+      af[rows] = af_values.apply(pd.to_numeric, errors="coerce").max(axis=1)
+
+  #callers without a FORMAT AF (e.g. GATK HaplotypeCaller) get it from the allele depths
+  missing_af = np.isnan(af)
+  with np.errstate(invalid="ignore", divide="ignore"):
+    af[missing_af] = (alt_depth / (ref_depth + alt_depth))[missing_af]
+  return ref_depth, alt_depth, af
+
+def iterVCFChunks(vcf_path, samples=None, chunksize=100000, min_alt_depth=1, info_fields=()):
+  #streams a VCF(.gz) in chunks of n=chunksize records, yielding a {sample: DataFrame} dict per chunk.
+  #Rows without AD for a sample, or with less than min_alt_depth alternative reads, are left out of
+  #that sample's table. info_fields are extracted from INFO as extra (numeric if possible) columns.
+  meta_lines, columns, contigs = readVCFHeader(vcf_path)
+  all_samples = columns[9:]
+  samples = all_samples if samples is None else list(samples)
+  missing = set(samples) - set(all_samples)
+  if missing:
+    raise ValueError(f"Samples not in {vcf_path}: {sorted(missing)}")
+
+  usecols = ["#CHROM", "POS", "REF", "ALT", "FORMAT"] + (["INFO"] if info_fields else []) + samples
+  reader = pd.read_csv(vcf_path, sep="\t", skiprows=meta_lines, usecols=usecols, dtype=str, chunksize=chunksize,
+                       quoting=csv.QUOTE_NONE, na_filter=False)
+  with reader:
+    for raw in reader:
+      #the declared contigs give every chunk the same CHROM categories, unless the header is incomplete
+      use_contigs = bool(contigs) and raw["#CHROM"].isin(contigs).all()
+      base = pd.DataFrame({
+        "CHROM": pd.Categorical(raw["#CHROM"], categories=contigs) if use_contigs else raw["#CHROM"].astype("category"),
+        "POS": raw["POS"].to_numpy(dtype=np.int32),
+        "REF": raw["REF"].astype("category"),
+        "ALT": raw["ALT"].astype("category"),
+        "TYPE": findVariantType(raw["REF"], raw["ALT"]),
+      })
+      for field in info_fields:
+        values = raw["INFO"].str.extract(f"(?:^|;){field}=([^;]*)", expand=False)
+        try:
+          base[field] = pd.to_numeric(values)
+        except ValueError:
+          base[field] = values.astype("category")
+
+      chunk_frames = {}
+      for sample in samples:
+        ref_depth, alt_depth, af = parseSampleColumn(raw["FORMAT"], raw[sample])
+        keep = ~np.isnan(ref_depth) & ~np.isnan(alt_depth) & (alt_depth >= min_alt_depth)
+        sample_df = base[keep].reset_index(drop=True)
+        sample_df["AF"] = af[keep].astype(np.float32)
+        sample_df["REF_DEPTH"] = ref_depth[keep].astype(np.int32)
+        sample_df["ALT_DEPTH"] = alt_depth[keep].astype(np.int32)
+        chunk_frames[sample] = sample_df
+      yield chunk_frames
+
+def concatCategoricalFrames(frames):
+  #concatenates frames keeping categorical columns categorical, even if the chunks have different categories
+  if not frames:
+    return pd.DataFrame()
+  df = pd.concat(frames, ignore_index=True)
+  for column in frames[0].columns:
+    if isinstance(frames[0][column].dtype, pd.CategoricalDtype) and not isinstance(df[column].dtype, pd.CategoricalDtype):
+      df[column] = pd.Series(union_categoricals([frame[column] for frame in frames]), index=df.index)
+  return df
+
+def readVCF(vcf_path, samples=None, chunksize=100000, min_alt_depth=1, info_fields=()):
+  #loads a (multi-sample) VCF(.gz) into compact per-sample tables, chunk by chunk.
+  #Returns a list of DataFrames and a list of sample names, like dataFrameImport
+  pieces = {}
+  for chunk_frames in iterVCFChunks(vcf_path, samples=samples, chunksize=chunksize, min_alt_depth=min_alt_depth, info_fields=info_fields):
+    for sample, sample_df in chunk_frames.items():
+      pieces.setdefault(sample, []).append(sample_df)
+
+  sample_names = list(pieces.keys())
+  frames_list = [concatCategoricalFrames(pieces[sample]) for sample in sample_names]
+  for sample, df in zip(sample_names, frames_list):
+    print(f'dataframe {sample} has {len(df)} total rows')
+  return frames_list, sample_names
+
+def streamQualitySNPFilter(vcf_path, samples=None, chunksize=100000, min_af=0.35, min_alt_reads=5, min_depth=10):
+  #runs the qualitySNPFilter filters on every chunk as it streams, so only passing variants are kept in memory.
+  #Returns a list of filtered DataFrames and a list of sample names
+  pieces = {}
+  for chunk_frames in iterVCFChunks(vcf_path, samples=samples, chunksize=chunksize, min_alt_depth=min_alt_reads):
+    for sample, sample_df in chunk_frames.items():
+      pieces.setdefault(sample, []).append(filterSNPFrame(sample_df, min_af=min_af, min_alt_reads=min_alt_reads, min_depth=min_depth))
+
+  sample_names = list(pieces.keys())
+  return [concatCategoricalFrames(pieces[sample]) for sample in sample_names], sample_names
@@ -0,0 +1,42 @@
+from BioAid.MMBSearchTK.AnnoMMBS import MMBSearchRecordError, iterMMBSearchRecords
+
+def makeRecord(bir_start):
+  return ["###",
+          f"iBirStart: {bir_start}",
+          "Consensus/cluster number: 1",
+          "iDepth: 10",
+          "sBir: ACGTACGT",
+          "sBirReversed: TGCATGCA",
+          "--------",
+          "ref: ACGTACGTAC",
+          "bir: ACGTACGTAC",
+          "TEM: ACGT",
+          "readStart: 100",
+          "ref: ACGTACGTAC",
+          "bir: ACGTACGTAC",
+          "free line 1",
+          "free line 2",
+          "free line 3"]
+
+def parse(lines):
+  records = list(iterMMBSearchRecords(lines, "chr1", path="report.txt"))
+  events = [record for record in records if not isinstance(record, MMBSearchRecordError)]
+  errors = [record for record in records if isinstance(record, MMBSearchRecordError)]
+  return events, errors
+
+def test_truncated_record_keeps_next_record():
+  #record 2 is cut after sBirReversed:, its error must not swallow record 3
+  truncated = makeRecord(2000)[:6]
+  lines = makeRecord(1000) + truncated + makeRecord(3000) + makeRecord(4000)
+  events, errors = parse(lines)
+  assert [event["iBirStart"] for event in events] == [1000, 3000, 4000]
+  assert len(errors) == 1
+  assert errors[0].line_number == 16 + len(truncated) + 1
+  assert "sBirReversed" in str(errors[0])
+
+def test_truncated_before_labeled_line_keeps_next_record():
+  lines = makeRecord(1000)[:8] + makeRecord(2000)
+  events, errors = parse(lines)
+  assert [event["iBirStart"] for event in events] == [2000]
+  assert len(errors) == 1
+  assert "'bir:'" in str(errors[0])